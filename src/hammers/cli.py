@@ -0,0 +1,80 @@
+"""Command line handling shared by hammers."""
+
+import argparse
+import functools
+
+from keystoneauth1.session import TCPKeepAliveAdapter
+import openstack
+from openstack.connection import Connection
+from requests.adapters import DEFAULT_POOLSIZE
+import yaml
+
+# use libyaml's parser when pyyaml was built with it
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def base_parser(**kwargs) -> argparse.ArgumentParser:
+    """Return a parser with the arguments every cleaner accepts."""
+    parser = argparse.ArgumentParser(**kwargs)
+
+    parser.add_argument(
+        "--cloud",
+        help="item in clouds.yaml to connect to, same as OS_CLOUD",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print out which resources would be cleaned up, instead of acting on them.",
+    )
+    parser.add_argument("--debug", action="store_true", help="increase log verbosity.")
+    return parser
+
+
+def add_expired_project_args(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments used to decide whether a project has expired."""
+    parser.add_argument(
+        "--grace-days",
+        type=int,
+        default=0,
+        help="How many days does a resource need to be unused before we'll clean it up",
+    )
+    parser.add_argument(
+        "--portal-api-token",
+        type=str,
+        required=True,
+        help="API token for portal",
+    )
+    parser.add_argument(
+        "--ignore-pending",
+        action="store_true",
+        help="Ignore resources from a project with a pending allocation."
+    )
+
+
+def load_yaml(stream):
+    """Safely load a YAML document, like `yaml.safe_load`."""
+    return yaml.load(stream, Loader=YAML_LOADER)
+
+
+@functools.cache
+def get_connection(cloud: str = None) -> Connection:
+    """Return a connection to `cloud`, reusing it if one was already made.
+
+    Hammers run back to back in one process share the connection and its
+    keystone token, rather than authenticating again.
+    """
+    return openstack.connect(cloud=cloud)
+
+
+def size_connection_pool(connection: Connection, size: int) -> None:
+    """Keep up to `size` connections per host open on the connection's session.
+
+    requests pools 10 connections per host by default. Cleaners running more
+    workers than that would otherwise keep opening and dropping connections,
+    paying a TLS handshake each time.
+    """
+    if size <= DEFAULT_POOLSIZE:
+        return
+    adapter = TCPKeepAliveAdapter(pool_connections=size, pool_maxsize=size)
+    for scheme in ("https://", "http://"):
+        connection.session.session.mount(scheme, adapter)
@@ -2,12 +2,14 @@
 
 import argparse
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 import sys
 import openstack
 from datetime import timedelta as TimeDelta
 
-from hammers.utils import project_is_expired
+from hammers import cli
+from hammers.utils import expired_projects
 
 
 logging.basicConfig(
@@ -21,34 +23,13 @@ LOG = logging.getLogger(__name__)
 
 def parse_args(args: list[str]) -> argparse.Namespace:
     """Handle CLI arguments."""
-    parser = argparse.ArgumentParser()
-
-    parser.add_argument(
-        "--cloud",
-        help="item in clouds.yaml to connect to, same as OS_CLOUD",
-    )
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="print out which servers would be shelved, instead of shelving them.",
-    )
-    parser.add_argument("--debug", action="store_true", help="increase log verbosity.")
+    parser = cli.base_parser()
+    cli.add_expired_project_args(parser)
     parser.add_argument(
-        "--grace-days",
+        "--parallel",
         type=int,
-        default=0,
-        help="How many days does a resource need to be unused before we'll clean it up",
-    )
-    parser.add_argument(
-        "--portal-api-token",
-        type=str,
-        required=True,
-        help="API token for portal",
-    )
-    parser.add_argument(
-        "--ignore-pending",
-        action="store_true",
-        help="Ignore servers from a project with a pending allocation."
+        default=16,
+        help="Maximum number of concurrent API requests.",
     )
     return parser.parse_args(args)
 
@@ -64,30 +45,48 @@ def main(arg_list: list[str]) -> None:
     dry_run = args.dry_run
     ignore_pending = args.ignore_pending
 
-    if args.debug:
-        LOG.setLevel(logging.DEBUG)
-
-    conn = openstack.connect(cloud=args.cloud)
+    conn = cli.get_connection(args.cloud)
+    cli.size_connection_pool(conn, args.parallel)
     servers_by_project = defaultdict(list)
-    for server in conn.compute.servers(all_projects=True):
-        if server.status == "ACTIVE":
-            servers_by_project[server.project_id].append(server)
 
-    projects_by_id = {p.id: p for p in conn.identity.projects()}
-
-    for project_id, servers in servers_by_project.items():
-        # Some old KVM projects have `charge_code` set, but new ones use `name`
-        charge_code = projects_by_id[project_id].get("charge_code")
-        if not charge_code:
-            charge_code = projects_by_id[project_id].name
-        LOG.info(f"Checking project {charge_code}")
-        if project_is_expired(charge_code, grace_period, ignore_pending, api_token, LOG):
-            for server in servers:
-                if dry_run:
-                    LOG.info("DRY-RUN: Shelving server %s:%s", server.id, server.name)
-                else:
-                    LOG.info("Shelving server %s:%s", server.id, server.name)
-                    server.shelve()
+    def _project_ids(servers):
+        # group servers as they stream in, handing each project id on for lookup
+        for server in servers:
+            servers_by_project[server.project_id].append(server)
+            yield server.project_id
+
+    expired = expired_projects(
+        conn,
+        _project_ids(conn.compute.servers(all_projects=True, status="ACTIVE")),
+        grace_period,
+        ignore_pending,
+        api_token,
+        LOG,
+        parallel=args.parallel,
+    )
+    LOG.info("Found %s expired projects out of %s", len(expired), len(servers_by_project))
+
+    servers_to_shelve = [
+        server for project_id in expired for server in servers_by_project[project_id]
+    ]
+
+    if dry_run:
+        for server in servers_to_shelve:
+            LOG.info("DRY-RUN: Shelving server %s:%s", server.id, server.name)
+        return
+
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        future_to_server = {}
+        for server in servers_to_shelve:
+            LOG.info("Shelving server %s:%s", server.id, server.name)
+            future_to_server[executor.submit(conn.compute.shelve_server, server)] = server
+
+        for future in as_completed(future_to_server):
+            server = future_to_server[future]
+            try:
+                future.result()
+            except Exception as exc:
+                LOG.error("Error shelving server %s:%s: %s", server.id, server.name, exc)
 
 
 def launch_main():
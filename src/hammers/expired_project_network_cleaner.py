@@ -2,12 +2,15 @@
 
 import argparse
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
 import logging
 import sys
 import openstack
 from datetime import timedelta as TimeDelta
 
-from hammers.utils import project_is_expired
+from hammers import cli
+from hammers.utils import expired_projects
 
 
 logging.basicConfig(
@@ -18,37 +21,83 @@ logging.basicConfig(
 openstack.enable_logging(debug=False)
 LOG = logging.getLogger(__name__)
 
+# Port attributes used when tearing down a network
+PORT_FIELDS = ["id", "network_id", "device_owner", "device_id", "fixed_ips"]
+
+
+def delete_network(conn, network, ports, dry_run: bool) -> None:
+    """Delete a network, after removing its ports and router interfaces."""
+    network_id = network.id
+    for port in ports:
+        port_id = port.id
+        if port.device_owner == "network:router_interface":
+            # Need to remove the router interface before deleting the port
+            router_id = port.device_id
+            subnet_id = port.fixed_ips[0]["subnet_id"]
+            if dry_run:
+                LOG.info("Would remove router interface from router %s for subnet %s", router_id, subnet_id)
+            else:
+                LOG.info("Deleting router interface from router %s for subnet %s", router_id, subnet_id)
+                conn.network.remove_interface_from_router(router_id, subnet_id=subnet_id)
+        if dry_run:
+            LOG.info("Would delete port %s on network %s", port_id, network_id)
+        else:
+            LOG.info("Deleting port %s on network %s", port_id, network_id)
+            conn.network.delete_port(port_id)
+    if dry_run:
+        LOG.info("Would delete network %s", network_id)
+    else:
+        LOG.info("Deleting network %s", network_id)
+        conn.network.delete_network(network_id)
+
+
+def delete_router(conn, router, dry_run: bool) -> None:
+    """Delete a router."""
+    if dry_run:
+        LOG.info("Would delete router %s, %s", router.id, router.name)
+    else:
+        LOG.info("Deleting router %s, %s", router.id, router.name)
+        conn.network.delete_router(router.id)
+
+
+def ports_by_network(conn, networks) -> dict:
+    """Return the ports on the given networks, grouped by network id, in one query."""
+    result = defaultdict(list)
+    if not networks:
+        return result
+    ports = conn.network.ports(
+        network_id=[n.id for n in networks],
+        fields=PORT_FIELDS,
+    )
+    for port in ports:
+        result[port.network_id].append(port)
+    return result
+
+
+def run_concurrently(func, resources, parallel: int) -> None:
+    """Apply `func` to each resource in a thread pool, logging any failures."""
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        future_to_resource = {
+            executor.submit(func, resource): resource
+            for resource in resources
+        }
+        for future in as_completed(future_to_resource):
+            resource = future_to_resource[future]
+            try:
+                future.result()
+            except Exception as exc:
+                LOG.error("Error cleaning up %s %s: %s", type(resource).__name__, resource.id, exc)
+
 
 def parse_args(args: list[str]) -> argparse.Namespace:
     """Handle CLI arguments."""
-    parser = argparse.ArgumentParser()
-
+    parser = cli.base_parser()
+    cli.add_expired_project_args(parser)
     parser.add_argument(
-        "--cloud",
-        help="item in clouds.yaml to connect to, same as OS_CLOUD",
-    )
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="print out which servers would be shelved, instead of shelving them.",
-    )
-    parser.add_argument("--debug", action="store_true", help="increase log verbosity.")
-    parser.add_argument(
-        "--grace-days",
+        "--parallel",
         type=int,
-        default=0,
-        help="How many days does a resource need to be unused before we'll clean it up",
-    )
-    parser.add_argument(
-        "--portal-api-token",
-        type=str,
-        required=True,
-        help="API token for portal",
-    )
-    parser.add_argument(
-        "--ignore-pending",
-        action="store_true",
-        help="Ignore servers from a project with a pending allocation."
+        default=8,
+        help="Maximum number of concurrent API requests.",
     )
     return parser.parse_args(args)
 
@@ -64,64 +113,55 @@ def main(arg_list: list[str]) -> None:
     dry_run = args.dry_run
     ignore_pending = args.ignore_pending
 
-    if args.debug:
-        LOG.setLevel(logging.DEBUG)
-
-    conn = openstack.connect(cloud=args.cloud)
-    projects_by_id = {p.id: p for p in conn.identity.projects()}
-    
+    conn = cli.get_connection(args.cloud)
+    cli.size_connection_pool(conn, args.parallel)
 
     networks_by_project = defaultdict(list)
-    for network in conn.network.networks(is_shared=False):
-        if network.project_id:
-            networks_by_project[network.project_id].append(network)
-
-    for project_id, networks in networks_by_project.items():
-        # Some old KVM projects have `charge_code` set, but new ones use `name`
-        charge_code = projects_by_id[project_id].get("charge_code")
-        if not charge_code:
-            charge_code = projects_by_id[project_id].name
-        if project_is_expired(charge_code, grace_period, ignore_pending, api_token, LOG):
-            for network in networks:
-                ports = conn.network.ports(network_id=network.id)                
-                for port in ports:
-                    if port.device_owner=="network:router_interface":
-                        # Need to remove the router interface before deleting the port
-                        router_id = port.device_id
-                        subnet_id = port.fixed_ips[0]['subnet_id']
-                        if dry_run:
-                            LOG.info(f"Would remove router interface from router {router_id} for subnet {subnet_id}")
-                        else:
-                            LOG.info(f"Deletingrouter interface from router {router_id} for subnet {subnet_id}")
-                            conn.network.remove_interface_from_router(router_id, subnet_id=subnet_id)
-                    if dry_run:
-                        LOG.info(f"Would delete port {port.id} on network {network.id}")
-                    else:
-                        LOG.info(f"Deleting port {port.id} on network {network.id}")
-                        conn.network.delete_port(port.id)
-                if dry_run:
-                    LOG.info(f"Would delete network {network.id}")
-                else:
-                    LOG.info(f"Deleting network {network.id}")
-                    conn.network.delete_network(network.id)
-
     routers_by_project = defaultdict(list)
-    for router in conn.network.routers():
-        if router.project_id:
-            routers_by_project[router.project_id].append(router)
-
-    for project_id, routers in routers_by_project.items():
-        # Some old KVM projects have `charge_code` set, but new ones use `name`
-        charge_code = projects_by_id[project_id].get("charge_code")
-        if not charge_code:
-            charge_code = projects_by_id[project_id].name
-        if project_is_expired(charge_code, grace_period, ignore_pending, api_token, LOG):
-            for router in routers:
-                if dry_run:
-                    LOG.info(f"Would delete router {router.id}, {router.name}")
-                else:
-                    LOG.info(f"Deleting router {router.id}, {router.name}")
-                    conn.network.delete_router(router.id)
+
+    def _project_ids(resources_by_project, resources):
+        # group resources as they stream in, handing each project id on for lookup
+        for resource in resources:
+            if resource.project_id:
+                resources_by_project[resource.project_id].append(resource)
+                yield resource.project_id
+
+    # check each project once, whether it owns networks, routers, or both
+    expired = expired_projects(
+        conn,
+        chain(
+            _project_ids(networks_by_project, conn.network.networks(is_shared=False)),
+            _project_ids(routers_by_project, conn.network.routers()),
+        ),
+        grace_period,
+        ignore_pending,
+        api_token,
+        LOG,
+        parallel=args.parallel,
+    )
+
+    networks_to_delete = []
+    ports = {}
+    for project_id in expired:
+        networks = networks_by_project.get(project_id, [])
+        networks_to_delete.extend(networks)
+        ports.update(ports_by_network(conn, networks))
+    run_concurrently(
+        lambda network: delete_network(conn, network, ports.get(network.id, []), dry_run),
+        networks_to_delete,
+        args.parallel,
+    )
+
+    routers_to_delete = [
+        router
+        for project_id in expired
+        for router in routers_by_project.get(project_id, [])
+    ]
+    run_concurrently(
+        lambda router: delete_router(conn, router, dry_run),
+        routers_to_delete,
+        args.parallel,
+    )
 
 
 def launch_main():
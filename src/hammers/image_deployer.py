@@ -1,17 +1,50 @@
 import argparse
 import datetime
+import functools
 import json
 import logging
 import os
 import requests
 import sys
 import tempfile
-import yaml
 
 import openstack
 
-from itertools import islice
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+from hammers import cli
+
+
+def _object_store_session():
+    """Return a session which pools and retries connections to the object store."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+            # hand the final response back so callers can report its status
+            raise_on_status=False,
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Size of the chunks images are downloaded and written to disk in
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # 4 MiB
+
+# Shared by every object store request, so connections are reused across
+# listings, manifests and downloads (and across threads).
+SESSION = _object_store_session()
+
 
 class Image:
     def __init__(self, name, type, base_container, scope, current_path):
@@ -28,6 +61,8 @@ class Image:
     def __str__(self):
         return f"Image(name={self.name})"
 
+    __repr__ = __str__
+
 
 class NullProgressBar:
     def __init__(self, *args, **kwargs):
@@ -74,18 +109,34 @@ def get_openstack_connection(cloud_name):
 
 def get_current_value(storage_url, base_container, scope):
     url = f"{storage_url}/{base_container}/{scope}/current"
-    response = requests.get(url)
+    response = SESSION.get(url)
     if response.status_code != 200:
         raise Exception(f"Error getting current value: {response.content}")
     return json.loads(response.text.strip())
 
 
+def list_image_versions(storage_url, base_container, scope, current):
+    """List the objects stored under the current version prefix of an image."""
+    current_path = f"{scope}/versions/{current}"
+    url = f"{storage_url}/{base_container}/?prefix={current_path}&format=json"
+    logging.debug(f"Checking available images at {url}...")
+    response = SESSION.get(url)
+    if response.status_code != 200:
+        raise Exception("Error getting available images: " +
+                        f"{response.content}")
+
+    current_objects = [obj["name"] for obj in response.json()]
+    logging.debug(f"Current objects: {current_objects}")
+    return current_path, current_objects
+
+
 def get_available_images(
         storage_url,
         base_container,
         scope,
         current_values,
-        image_type):
+        image_type,
+        parallel=16):
     """
     This method loads the names of available images from the central image
     store. It reads from the current values, which are stored in the
@@ -103,24 +154,28 @@ def get_available_images(
 
     It also validates that the images specified in the current values
     are actually present in the central image store and adds those
-    that are present to the list of available images.
+    that are present to the list of available images. The listing for
+    each version is fetched once, concurrently, up to `parallel` at a time.
     """
     available_images = []
 
-    for image_name in current_values.keys():
-        current = current_values[image_name]
-        current_path = f"{scope}/versions/{current}"
-        url = f"{storage_url}/{base_container}/?prefix={current_path}"
-        logging.debug(f"Checking available images at {url}...")
-        response = requests.get(url)
-        if response.status_code != 200:
-            raise Exception("Error getting available images: " +
-                            f"{response.content}")
-
-        current_objects = response.text.splitlines()
-        logging.debug(f"Current objects: {current_objects}")
-        for object in islice(current_objects, 1, None):
-            object_name = object.split("/")[-1]
+    # several images are usually published under the same version
+    versions = list(dict.fromkeys(current_values.values()))
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        listings = dict(zip(versions, executor.map(
+            lambda current: list_image_versions(
+                storage_url,
+                base_container,
+                scope,
+                current,
+            ),
+            versions,
+        )))
+
+    for image_name, current in current_values.items():
+        current_path, current_objects = listings[current]
+        for object in current_objects:
+            object_name = object.rsplit("/", 1)[-1]
             logging.debug(f"Checking object: {object_name}")
             if object_name.endswith(image_name + ".manifest"):
                 name = object_name[:-len(".manifest")]
@@ -138,34 +193,21 @@ def get_available_images(
 
 
 def get_site_images(connection):
+    """Return public site images, grouped by name, from a single listing."""
     logging.debug("Checking public site images...")
-    images = [
-        i.name
-        for i in connection.image.images(
-            visibility="public"
-        )
-    ]
+    images = defaultdict(list)
+    for i in connection.image.images(visibility="public"):
+        images[i.name].append(i)
     return images
 
 
-def should_sync_image(image_connection, image_name, site_images, current):
-    matching_images = [
-        site_image_name for site_image_name in site_images
-        if site_image_name == image_name
-    ]
+def should_sync_image(site_images, image_name, current):
+    matching_images = site_images.get(image_name, [])
 
     if len(matching_images) == 1:
         logging.debug(f"Image {image_name} already in site images.")
 
-        image = next(
-            image_connection.image.images(name=image_name, visibility="public"),
-            None
-        )
-        if image is None:
-            logging.warning(f"Image {image_name} with public visibility not found, syncing.")
-            return True
-
-        image_properties = image.properties
+        image_properties = matching_images[0].properties
         logging.debug(f"Image properties: {image_properties}")
         image_current_value = image_properties.get("current", None)
         logging.debug(f"Image {image_name} current value: {image_current_value}")
@@ -190,24 +232,24 @@ def download_object_to_file(
         temp_file,
         show_progress=False):
     url = f"{storage_url}/{path}/{file_name}"
-    response = requests.get(url, stream=True)
+    response = SESSION.get(url, stream=True)
 
     if response.status_code != 200:
         raise Exception(f"Error downloading object {file_name}: {response.content}")
 
     total_size = int(response.headers.get('Content-Length', 0))
-    chunk_size = 65536  # 64 KB
 
     progress_bar = (
         tqdm(total=total_size, unit='iB', unit_scale=True, desc=f"Downloading {file_name}")
         if show_progress else NullProgressBar()
     )
 
-    for chunk in response.iter_content(chunk_size=chunk_size):
-        temp_file.write(chunk)
-        temp_file.flush()
-        progress_bar.update(len(chunk))
+    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+        if chunk:
+            temp_file.write(chunk)
+            progress_bar.update(len(chunk))
 
+    temp_file.flush()
     progress_bar.close()
 
     if total_size != 0 and progress_bar.n != total_size:
@@ -249,11 +291,54 @@ def upload_image_to_glance(image_connection,
     return new_image
 
 
-def get_image_build_timestamp(image):
-    build_timestamp = image.properties.get("build-timestamp")
+def stream_object_to_glance(storage_url,
+                            path,
+                            file_name,
+                            image_connection,
+                            image_prefix,
+                            image_name,
+                            disk_format,
+                            manifest_data,
+                            show_progress=False):
+    """Upload an object to Glance as it is downloaded, without a local copy."""
+    image_prefix_name = image_prefix + image_name
+    url = f"{storage_url}/{path}/{file_name}"
+
+    logging.debug(f"Streaming {url} to Glance image {image_prefix_name}.")
+    with SESSION.get(url, stream=True) as response:
+        if response.status_code != 200:
+            raise Exception(f"Error downloading object {file_name}: {response.content}")
+
+        total_size = int(response.headers.get('Content-Length', 0))
+        response.raw.decode_content = True
+        wrapped_stream = ProgressFileWrapper(
+            response.raw,
+            total_size,
+            desc=f"Streaming {image_name}",
+            show_progress=show_progress
+        )
 
+        new_image = image_connection.create_image(name=image_prefix_name,
+                                                  disk_format=disk_format,
+                                                  container_format="bare",
+                                                  visibility="private",
+                                                  data=wrapped_stream,
+                                                  **manifest_data)
+        wrapped_stream.close()
+
+    if total_size != 0 and wrapped_stream.progress_bar.n != total_size:
+        # don't leave a truncated image behind to be promoted later
+        image_connection.delete_image(new_image.id)
+        raise Exception(f"Download incomplete for {file_name}")
+
+    logging.debug(f"Uploaded image {new_image.name}.")
+    return new_image
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_build_timestamp(image_id, build_timestamp):
     if build_timestamp is None:
-        error = f"Unable to find build-timestamp on image {image.id}, " + \
+        error = f"Unable to find build-timestamp on image {image_id}, " + \
                 "using the current date instead."
         logging.error(error)
         return datetime.datetime.now().strftime("%Y%m%d %H%M%S.%f")
@@ -269,11 +354,18 @@ def get_image_build_timestamp(image):
             raise Exception(f"Invalid build_timestamp format: {build_timestamp}")
 
 
+def get_image_build_timestamp(image):
+    """Return the parsed build-timestamp of an image, parsing each image only once."""
+    return _parse_build_timestamp(image.id, image.properties.get("build-timestamp"))
+
+
 def archive_image(image_connection,
                   image,
-                  image_metadata_field="chameleon-supported"):
+                  image_metadata_field="chameleon-supported",
+                  archive_date=None):
     logging.debug(f"Renaming existing image {image.name}.")
-    archive_date = get_image_build_timestamp(image)
+    if archive_date is None:
+        archive_date = get_image_build_timestamp(image)
     archived_name = f"{image.name}_{archive_date}"
     image_connection.image.update_image(
         image.id,
@@ -313,12 +405,15 @@ def promote_image(image_connection,
         logging.info(f"Image {image_name} updated to {new_image.id}: " +
                      f"{build_timestamp}")
     elif len(existing_images) == 1:
-        archive_image(image_connection, existing_images[0])
+        old_image_id = existing_images[0].id
+        old_build_timestamp = get_image_build_timestamp(existing_images[0])
+        archive_image(image_connection,
+                      existing_images[0],
+                      image_metadata_field=image_metadata_field,
+                      archive_date=old_build_timestamp)
         image_connection.image.update_image(new_image.id,
                                             name=image_name,
                                             visibility="public")
-        old_image_id = existing_images[0].id
-        old_build_timestamp = get_image_build_timestamp(existing_images[0])
         logging.info(f"Image {image_name} updated to {new_image.id}: " +
                      f"{build_timestamp} from {old_image_id}:" +
                      f"{old_build_timestamp}")
@@ -332,7 +427,7 @@ def promote_image(image_connection,
 
 
 def get_manifest_data(manifest_url):
-    response = requests.get(manifest_url)
+    response = SESSION.get(manifest_url)
     if response.status_code != 200:
         raise Exception(f"Error downloading object {manifest_url}: {response.content}")
     return response.json()
@@ -346,8 +441,14 @@ def sync_image(storage_url,
                image_prefix="_testing",
                image_type="qcow2",
                dry_run=False,
-               show_progress=False):
-    """Sync a single image from the central image store to the site."""
+               show_progress=False,
+               buffer_to_disk=False):
+    """Sync a single image from the central image store to the site.
+
+    The image is streamed from the object store straight into Glance, unless
+    `buffer_to_disk` is set, in which case it is downloaded to a temporary
+    file first.
+    """
 
     # TODO: move dry run to more of the steps
     if dry_run:
@@ -361,20 +462,36 @@ def sync_image(storage_url,
         logging.debug(f"Downloaded {image.name} manifest: {manifest_data}, downloading image file.")
 
         try:
-            with tempfile.NamedTemporaryFile(delete=True) as temp_file:
-                download_object_to_file(
+            if buffer_to_disk:
+                with tempfile.NamedTemporaryFile(
+                    delete=True,
+                    buffering=DOWNLOAD_CHUNK_SIZE,
+                ) as temp_file:
+                    download_object_to_file(
+                        storage_url,
+                        image.container_path,
+                        image.disk_name,
+                        temp_file,
+                        show_progress,
+                    )
+
+                    glance_image = upload_image_to_glance(
+                        image_connection,
+                        image_prefix,
+                        image.name,
+                        temp_file,
+                        image_type,
+                        manifest_data,
+                        show_progress,
+                    )
+            else:
+                glance_image = stream_object_to_glance(
                     storage_url,
                     image.container_path,
                     image.disk_name,
-                    temp_file,
-                    show_progress,
-                )
-
-                glance_image = upload_image_to_glance(
                     image_connection,
                     image_prefix,
                     image.name,
-                    temp_file,
                     image_type,
                     manifest_data,
                     show_progress,
@@ -400,36 +517,45 @@ def do_sync(storage_url,
             image_prefix="testing_",
             image_type="qcow2",
             dry_run=False,
-            show_progress=False):
+            show_progress=False,
+            buffer_to_disk=False,
+            parallel=4):
     """iterate through latest images from the central image store and sync to the site"""
 
     images_to_sync = []
     for available_image in available_images:
         current = current_values[available_image.name]
-        if should_sync_image(image_connection, available_image.name, site_images, current):
-            images_to_sync.append(available_image)
+        if should_sync_image(site_images, available_image.name, current):
+            images_to_sync.append((available_image, current))
 
     num_available_images = len(available_images)
     num_images_to_sync = len(images_to_sync)
     num_images_to_skip = num_available_images - num_images_to_sync
-    logging.info(f"Found {num_available_images} available images. " +
-                 f"Already have {num_images_to_skip} images. " +
-                 "Syncing {num_images_to_sync} images: {images_to_sync}".format(
-                     num_images_to_sync=num_images_to_sync,
-                     images_to_sync=[str(i) for i in images_to_sync]))
-
-    for image_to_sync in images_to_sync:
-        sync_image(
-            storage_url,
-            image_connection,
-            image_to_sync,
-            current=current_values[image_to_sync.name],
-            image_metadata_field=image_metadata_field,
-            image_prefix=image_prefix,
-            image_type=image_type,
-            dry_run=dry_run,
-            show_progress=show_progress,
-        )
+    logging.info("Found %d available images. Already have %d images. Syncing %d images: %s",
+                 num_available_images, num_images_to_skip, num_images_to_sync,
+                 [image for image, _ in images_to_sync])
+
+    # sync_image logs its own failures, so a result is only fetched to
+    # surface anything unexpected
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = [
+            executor.submit(
+                sync_image,
+                storage_url,
+                image_connection,
+                image_to_sync,
+                current=current,
+                image_metadata_field=image_metadata_field,
+                image_prefix=image_prefix,
+                image_type=image_type,
+                dry_run=dry_run,
+                show_progress=show_progress,
+                buffer_to_disk=buffer_to_disk,
+            )
+            for image_to_sync, current in images_to_sync
+        ]
+        for future in as_completed(futures):
+            future.result()
     logging.info("Sync complete.")
 
 
@@ -448,6 +574,11 @@ def parse_args(args: list[str]) -> argparse.Namespace:
                         help="Enable debug logging")
     parser.add_argument("--show-progress", action="store_true",
                         help="Show the progress when downloading and uploading images.")
+    parser.add_argument("--parallel", type=int, default=4,
+                        help="Maximum number of images to sync concurrently.")
+    parser.add_argument("--buffer-to-disk", action="store_true",
+                        help="Download each image to a temporary file before uploading it, "
+                             "instead of streaming it to Glance.")
     # TODO(pdmars): add a force sync flag that overrides the current check
 
     return parser.parse_args(args)
@@ -468,7 +599,7 @@ def main(arg_list: list[str]) -> None:
     #    supports = yaml.safe_load(f)
 
     with open(args.site_yaml, "r") as f:
-        site = yaml.safe_load(f)
+        site = cli.load_yaml(f)
 
     base_container = site.get("image_container", "chameleon-supported-images")
     image_metadata_field = site.get("image_metadata_field", "chameleon-supported")
@@ -501,7 +632,7 @@ def main(arg_list: list[str]) -> None:
     )
 
     site_images = get_site_images(image_connection)
-    logging.debug(f"Site Images: {site_images}")
+    logging.debug(f"Site Images: {list(site_images)}")
 
     do_sync(
         storage_url,
@@ -514,6 +645,8 @@ def main(arg_list: list[str]) -> None:
         image_type=image_type,
         dry_run=args.dry_run,
         show_progress=args.show_progress,
+        buffer_to_disk=args.buffer_to_disk,
+        parallel=args.parallel,
     )
 
 
@@ -2,12 +2,16 @@
 
 import argparse
 import logging
+import time
 from collections.abc import Generator
 from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
 import openstack
 from openstack.compute.v2.server import Server
 from openstack.connection import Connection
+from openstack.image.v2.image import Image
+
+from hammers import cli
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,19 +21,39 @@ logging.basicConfig(
 openstack.enable_logging(debug=False)
 LOG = logging.getLogger(__name__)
 
+# Servers requested per page. Nova caps this at its osapi_max_limit.
+SERVER_PAGE_SIZE = 1000
+
+# How long to wait for snapshots to become active, and how often to check, in seconds
+SNAPSHOT_TIMEOUT = 3600
+SNAPSHOT_POLL_INTERVAL = 10
+
+# Snapshot ids per Glance status query, keeps the query string well under URL
+# length limits (each id adds ~37 bytes)
+SNAPSHOT_QUERY_BATCH_SIZE = 100
+
+# Glance statuses from which a snapshot will never become active
+FAILED_SNAPSHOT_STATUSES = frozenset({"killed", "deleted", "deactivated"})
+
+# Projects whose instances are never retired
+ADMIN_PROJECT_IDS = frozenset({
+    "570aad8999f7499db99eae22fe9b29bb",
+    "f6c7696906c04b3c89fc3bda9a1b8be0",
+})
+
 
 def get_instances_to_retire(connection: Connection) -> Generator[Server]:
     instances = connection.compute.servers(
         all_projects=True,
+        limit=SERVER_PAGE_SIZE,
     )  # type: ignore
     for instance in instances:
+        # match on the embedded flavor name, so instances of m1 flavors that
+        # have since been deleted are still found
         if not instance.flavor.original_name.startswith("m1"):
             continue
 
-        if instance.project_id in [
-            "570aad8999f7499db99eae22fe9b29bb",
-            "f6c7696906c04b3c89fc3bda9a1b8be0",
-        ]:
+        if instance.project_id in ADMIN_PROJECT_IDS:
             LOG.info(
                 "Skipping admin instance %s %s %s",
                 instance.name,
@@ -46,20 +70,23 @@ def ensure_instance_is_snapshotted(
     connection: Connection,
     instance: Server,
     i_really_mean_it: bool,
+    admin_project_id: str = None,
 ) -> None:
     snapshot_name = f"{instance.id}-snapshot"
 
-    admin_snapshots = connection.image.images(
-        name=snapshot_name,
-        owner=connection.current_project_id,
-    )
-    for snap in admin_snapshots:
-        connection.image.update_image(snap, owner=instance.project_id)
+    if admin_project_id is None:
+        admin_project_id = connection.current_project_id
+
+    # one listing covers both admin-owned and project-owned snapshots
+    snapshots = connection.image.images(name=snapshot_name)
+    existing_snapshots = []
+    for snap in snapshots:
+        if snap.owner == admin_project_id:
+            connection.image.update_image(snap, owner=instance.project_id)
+            existing_snapshots.append(snap)
+        elif snap.owner == instance.project_id:
+            existing_snapshots.append(snap)
 
-    existing_snapshots = connection.image.images(
-        name=snapshot_name,
-        owner=instance.project_id,
-    )
     for snap in existing_snapshots:
         LOG.debug(
             "Snapshot %s %s already exists for instance %s, skipping snapshot creation.",
@@ -71,10 +98,11 @@ def ensure_instance_is_snapshotted(
 
     if i_really_mean_it:
         LOG.info("snapshotting instance %s %s", instance.name, instance.status)
+        # don't block this worker while the snapshot saves, main polls for it
         snapshot_image = connection.create_image_snapshot(
             name=snapshot_name,
             server=instance,
-            wait=True,
+            wait=False,
         )
         connection.image.update_image(snapshot_image, owner=instance.project_id)
         return snapshot_image
@@ -82,17 +110,38 @@ def ensure_instance_is_snapshotted(
         LOG.info("Would snapshot instance %s %s", instance.name, instance.id)
 
 
+def shelve_instance(
+    connection: Connection,
+    instance: Server,
+    i_really_mean_it: bool,
+) -> None:
+    if i_really_mean_it:
+        LOG.info("Shelving instance %s %s", instance.name, instance.status)
+        connection.compute.shelve_server(instance)
+    else:
+        LOG.info(
+            "Would shelve instance %s %s %s",
+            instance.name,
+            instance.id,
+            instance.status,
+        )
+
+
 def retire_instance(
     connection: Connection,
     instance: Server,
     i_really_mean_it: bool,
-) -> Server:
+    admin_project_id: str = None,
+) -> tuple[Server, Image]:
     """Retire non-reservable instances by shelving them.
 
     1. lock the instance (shelved and locked counts towards quota)
     2. shut down the instance
     3. snapshot the instance, ensure owned by the project
     4. shelve the instance (must wait for snapshot to complete)
+
+    Returns the instance, and its snapshot if it is still being saved. Those
+    instances are shelved by `wait_for_snapshots` once the snapshot is active.
     """
 
     if instance.status in ["ACTIVE"]:
@@ -108,20 +157,79 @@ def retire_instance(
             connection=connection,
             instance=instance,
             i_really_mean_it=i_really_mean_it,
+            admin_project_id=admin_project_id,
         )
         if snapshotted:
-            if i_really_mean_it:
-                LOG.info("Shelving instance %s %s", instance.name, instance.status)
-                connection.compute.shelve_server(instance)
-            else:
+            if i_really_mean_it and snapshotted.status != "active":
                 LOG.info(
-                    "Would shelve instance %s %s %s",
+                    "Snapshot %s of instance %s is %s, shelving once it is active",
+                    snapshotted.id,
                     instance.name,
-                    instance.id,
-                    instance.status,
+                    snapshotted.status,
                 )
+                return instance, snapshotted
+            shelve_instance(connection, instance, i_really_mean_it)
+
+    return instance, None
+
+
+def wait_for_snapshots(
+    connection: Connection,
+    instances_by_snapshot_id: dict[str, Server],
+    i_really_mean_it: bool,
+    timeout: int = SNAPSHOT_TIMEOUT,
+    interval: int = SNAPSHOT_POLL_INTERVAL,
+    batch_size: int = SNAPSHOT_QUERY_BATCH_SIZE,
+) -> None:
+    """Shelve instances as their snapshots become active.
+
+    The status of pending snapshots is checked with one Glance query per
+    batch of `batch_size` ids per poll, rather than one blocking wait per
+    snapshot. Glance does not list deleted images, so a snapshot missing from
+    the response is treated as failed.
+    """
+    pending = dict(instances_by_snapshot_id)
+    deadline = time.monotonic() + timeout
+    while pending:
+        snapshot_ids = list(pending)
+        for start in range(0, len(snapshot_ids), batch_size):
+            batch = snapshot_ids[start:start + batch_size]
+            snapshots = connection.image.images(id="in:" + ",".join(batch))
+            statuses = {snapshot.id: snapshot.status for snapshot in snapshots}
+            for snapshot_id in batch:
+                status = statuses.get(snapshot_id, "missing")
+                if status == "active":
+                    instance = pending.pop(snapshot_id)
+                    try:
+                        shelve_instance(connection, instance, i_really_mean_it)
+                    except Exception as exc:
+                        LOG.error(
+                            "Error shelving instance %s %s: %s",
+                            instance.name,
+                            instance.id,
+                            exc,
+                        )
+                elif status == "missing" or status in FAILED_SNAPSHOT_STATUSES:
+                    instance = pending.pop(snapshot_id)
+                    LOG.error(
+                        "Snapshot %s of instance %s %s is %s, not shelving",
+                        snapshot_id,
+                        instance.name,
+                        instance.id,
+                        status,
+                    )
 
-    return instance
+        if not pending or time.monotonic() >= deadline:
+            break
+        time.sleep(interval)
+
+    for snapshot_id, instance in pending.items():
+        LOG.warning(
+            "Timed out waiting for snapshot %s of instance %s %s",
+            snapshot_id,
+            instance.name,
+            instance.id,
+        )
 
 
 def parse_args() -> argparse.Namespace:
@@ -147,11 +255,14 @@ def main() -> None:
     """Drop the hammer."""
     args = parse_args()
     conn = openstack.connect(cloud=args.cloud)
+    cli.size_connection_pool(conn, args.parallel)
 
     LOG.info("Collecting instance and reservation info for cloud %s", args.cloud)
 
     instances_to_retire = get_instances_to_retire(conn)
+    admin_project_id = conn.current_project_id
 
+    instances_by_snapshot_id = {}
     with ThreadPoolExecutor(max_workers=args.parallel) as executor:
         future_to_retired_instance = {
             executor.submit(
@@ -159,13 +270,17 @@ def main() -> None:
                 connection=conn,
                 instance=instance,
                 i_really_mean_it=args.i_really_mean_it,
+                admin_project_id=admin_project_id,
             ): instance
             for instance in instances_to_retire
         }
         for future in as_completed(future_to_retired_instance):
             instance = future_to_retired_instance[future]
             try:
-                retired_instance = future.result()
+                retired_instance, pending_snapshot = future.result()
+                if pending_snapshot:
+                    instances_by_snapshot_id[pending_snapshot.id] = retired_instance
+                    continue
                 LOG.info(
                     "Finished! instance %s %s %s",
                     retired_instance.name,
@@ -180,6 +295,8 @@ def main() -> None:
                     exc,
                 )
 
+    wait_for_snapshots(conn, instances_by_snapshot_id, args.i_really_mean_it)
+
 
 if __name__ == "__main__":
     main()
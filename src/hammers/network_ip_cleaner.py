@@ -5,7 +5,10 @@ import logging
 import sys
 from collections.abc import Generator
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime as DateTime
 from datetime import timedelta as TimeDelta
+from datetime import timezone as TimeZone
 
 import openstack
 from openstack.connection import Connection
@@ -14,6 +17,7 @@ from openstack.network.v2.router import Router
 from openstack.network.v2.network import Network
 from openstack.network.v2.port import Port
 
+from hammers import cli
 from hammers.utils import grace_period_expired
 
 logging.basicConfig(
@@ -24,6 +28,13 @@ logging.basicConfig(
 openstack.enable_logging(debug=False)
 LOG = logging.getLogger(__name__)
 
+# device_owner values of the ports list_router_interfaces treats as internal
+ROUTER_INTERFACE_OWNERS = [
+    "network:router_interface",
+    "network:router_interface_distributed",
+    "network:ha_router_replicated_interface",
+]
+
 
 def _is_dhcp_port(port: Port) -> bool:
     """Check if port is a DHCP port"""
@@ -32,15 +43,17 @@ def _is_dhcp_port(port: Port) -> bool:
 
 def _is_router_port(port: Port) -> bool:
     """Check if port is a router interface or gateway"""
-    return port.device_owner in [
-        "network:router_interface",
-        "network:router_gateway",
-        "network:router_interface_distributed",
-        "network:ha_router_replicated_interface",
-    ]
+    return (
+        port.device_owner in ROUTER_INTERFACE_OWNERS
+        or port.device_owner == "network:router_gateway"
+    )
 
 
-def find_idle_networks(conn: Connection, grace_period) -> Generator[Network]:
+def find_idle_networks(
+    conn: Connection,
+    grace_period,
+    now: DateTime = None,
+) -> Generator[Network]:
     """Find idle networks that are safe to delete."""
 
     ports = conn.list_ports()
@@ -55,6 +68,8 @@ def find_idle_networks(conn: Connection, grace_period) -> Generator[Network]:
         }
     )
 
+    if now is None:
+        now = DateTime.now(tz=TimeZone.utc)
     for network in networks:
         safe_to_delete = True
         reasons = []
@@ -63,7 +78,7 @@ def find_idle_networks(conn: Connection, grace_period) -> Generator[Network]:
             safe_to_delete=False
             reasons.append("No updated at!")
             LOG.warning("Network %s is missing updated_at field, skipping.", network.id)
-        elif not grace_period_expired(network.updated_at, grace_period):
+        elif not grace_period_expired(network.updated_at, grace_period, now):
             safe_to_delete = False
             reasons.append("grace period")
 
@@ -93,9 +108,17 @@ def find_idle_networks(conn: Connection, grace_period) -> Generator[Network]:
             LOG.debug("Not deleting network %s for reasons %s", network.name, reasons)
 
 
-def find_idle_floating_ips(conn: Connection, grace_period) -> Generator[FloatingIP]:
-    floating_ips = conn.list_floating_ips()
-
+def find_idle_floating_ips(
+    conn: Connection,
+    grace_period,
+    now: DateTime = None,
+) -> Generator[FloatingIP]:
+    # neutron filters out in-use and blazar-managed addresses, the tag and
+    # status checks below are only a safeguard
+    floating_ips = conn.network.ips(status="DOWN", not_tags="blazar")
+
+    if now is None:
+        now = DateTime.now(tz=TimeZone.utc)
     for fip in floating_ips:
         if "blazar" in fip.tags:
             LOG.debug("skipping FIP %s, managed by blazar", fip.floating_ip_address)
@@ -103,7 +126,7 @@ def find_idle_floating_ips(conn: Connection, grace_period) -> Generator[Floating
         if fip.status == "ACTIVE":
             LOG.debug("skipping FIP %s, is active", fip.floating_ip_address)
             continue
-        if not grace_period_expired(fip.updated_at, grace_period):
+        if not grace_period_expired(fip.updated_at, grace_period, now):
             LOG.debug("skipping FIP %s, still in grace period", fip.floating_ip_address)
             continue
 
@@ -114,19 +137,22 @@ def find_idle_routers(
     conn: Connection,
     grace_period,
     ip_whitelist: set = None,
+    now: DateTime = None,
 ) -> Generator[Router]:
     routers = conn.list_routers()
+    # one port query for every router's internal interfaces, rather than one per router
+    routers_with_interfaces = {
+        p.device_id for p in conn.network.ports(device_owner=ROUTER_INTERFACE_OWNERS)
+    }
 
+    if now is None:
+        now = DateTime.now(tz=TimeZone.utc)
     for router in routers:
-        interfaces = conn.list_router_interfaces(
-            router=router,
-            interface_type="internal",
-        )
-        if len(interfaces) > 0:
+        if router.id in routers_with_interfaces:
             LOG.debug("skipping router %s, has active ports", router.id)
             continue
 
-        if not grace_period_expired(router.updated_at, grace_period):
+        if not grace_period_expired(router.updated_at, grace_period, now):
             LOG.debug("skipping router %s, still in grace period", router.id)
             continue
 
@@ -148,20 +174,34 @@ def find_idle_routers(
         yield router
 
 
+def reservable_floating_ips(conn: Connection) -> set[str]:
+    """Return the addresses of floating IPs blazar manages, or none if blazar can't be reached."""
+    try:
+        return {r.floating_ip_address for r in conn.reservation.floatingips()}
+    except Exception as ex:
+        LOG.warning("couldn't check reservable FIPs: %s", ex)
+        return set()
+
+
+def delete_floating_ips(conn: Connection, fips: list[FloatingIP], parallel: int) -> None:
+    """Delete floating IPs concurrently, logging any that fail."""
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        future_to_fip = {}
+        for f in fips:
+            LOG.info("deleting unused floating IP %s:%s", f.id, f.floating_ip_address)
+            future_to_fip[executor.submit(conn.delete_floating_ip, f.id)] = f
+
+        for future in as_completed(future_to_fip):
+            f = future_to_fip[future]
+            try:
+                future.result()
+            except Exception as exc:
+                LOG.error("Error deleting floating IP %s:%s: %s", f.id, f.floating_ip_address, exc)
+
+
 def parse_args(args: list[str]) -> argparse.Namespace:
     """Handle CLI arguments."""
-    parser = argparse.ArgumentParser()
-
-    parser.add_argument(
-        "--cloud",
-        help="item in clouds.yaml to connect to, same as OS_CLOUD",
-    )
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        help="print out which IPs would be removed, instead of deleting them.",
-    )
-    parser.add_argument("--debug", action="store_true", help="increase log verbosity.")
+    parser = cli.base_parser()
     parser.add_argument(
         "--grace-days",
         type=int,
@@ -183,6 +223,12 @@ def parse_args(args: list[str]) -> argparse.Namespace:
         action="store_true",
         help="Should router objects be acted on.",
     )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=8,
+        help="Maximum number of floating IPs to delete concurrently.",
+    )
     return parser.parse_args(args)
 
 
@@ -193,22 +239,34 @@ def main(arg_list: list[str]) -> None:
         LOG.setLevel(logging.DEBUG)
 
     grace_period = TimeDelta(days=args.grace_days)
+    # judge every resource against the same point in time
+    now = DateTime.now(tz=TimeZone.utc)
 
-    conn = openstack.connect(cloud=args.cloud)
+    conn = cli.get_connection(args.cloud)
+    cli.size_connection_pool(conn, args.parallel)
 
-    networks = list(find_idle_networks(conn=conn, grace_period=grace_period))
-    fips = list(find_idle_floating_ips(conn=conn, grace_period=grace_period))
-
-    try:
-        reservable_ips = {r.floating_ip_address for r in conn.reservation.floatingips()}
-    except Exception as ex:
-        print("couldn't check reservable FIPs:", ex)
-        reservable_ips = set()
-    routers = list(
-        find_idle_routers(
-            conn=conn, grace_period=grace_period, ip_whitelist=reservable_ips
+    # the listings are independent, so wait on the slowest rather than their sum
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        networks_future = executor.submit(
+            lambda: list(find_idle_networks(conn=conn, grace_period=grace_period, now=now))
         )
-    )
+        fips_future = executor.submit(
+            lambda: list(find_idle_floating_ips(conn=conn, grace_period=grace_period, now=now))
+        )
+        reservable_ips_future = executor.submit(reservable_floating_ips, conn)
+        routers_future = executor.submit(
+            lambda: list(
+                find_idle_routers(
+                    conn=conn,
+                    grace_period=grace_period,
+                    ip_whitelist=reservable_ips_future.result(),
+                    now=now,
+                )
+            )
+        )
+    networks = networks_future.result()
+    fips = fips_future.result()
+    routers = routers_future.result()
 
     LOG.info(
         "Found %s networks, %s fips, and %s routers to clean up",
@@ -226,12 +284,11 @@ def main(arg_list: list[str]) -> None:
                 conn.delete_network(n.id)
 
     if args.clean_floatingips:
-        for f in fips:
-            if args.dry_run:
+        if args.dry_run:
+            for f in fips:
                 LOG.info("DRY-RUN: remove floating IP %s:%s", f.id, f.floating_ip_address)
-            else:
-                LOG.info("deleting unused floating IP %s:%s", f.id, f.floating_ip_address)
-                conn.delete_floating_ip(f.id)
+        else:
+            delete_floating_ips(conn, fips, args.parallel)
 
     if args.clean_routers:
         for r in routers:
@@ -6,12 +6,12 @@ import logging
 import random
 from collections.abc import Generator
 from concurrent.futures import Future, ThreadPoolExecutor
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 
 import openstack
 from openstack.connection import Connection
 
-from hammers import utils
+from hammers import cli, utils
 
 logging.basicConfig(
     level=logging.INFO,
@@ -33,8 +33,16 @@ def get_nodes_to_inspect(
 ) -> Generator[utils.ReservableNode, None, None]:
     """Queue a node for inspection, and handle interruptions."""
     inspection_timedelta = timedelta(days=expire_days)
+    now = datetime.now(tz=timezone.utc)
+
+    inspectable_provision_states = utils.INSPECTABLE_PROVISION_STATES
+    if reinspect_failed:
+        inspectable_provision_states = inspectable_provision_states | {"inspect failed"}
+    provide = provide_manageable and not dry_run
 
     for node in nodes:
+        needs_inspection = node.needs_inspection(inspection_timedelta, now)
+
         ### Readonly checks
         if node.needs_bootmode_set():
             LOG.warning(
@@ -44,9 +52,9 @@ def get_nodes_to_inspect(
         if (
             not node.is_maintenance
             and node.provision_state == "manageable"
-            and not node.needs_inspection(inspection_timedelta)
+            and not needs_inspection
         ):
-            if provide_manageable and not dry_run:
+            if provide:
                 LOG.warning(
                     "setting node %s:%s to available, inspection may have been interrupted.",
                     node.uuid,
@@ -58,13 +66,9 @@ def get_nodes_to_inspect(
                     "Please run provide for node: node %s:%s", node.uuid, node.name
                 )
 
-        inspectable_provision_states = utils.INSPECTABLE_PROVISION_STATES
-        if reinspect_failed:
-            inspectable_provision_states.append("inspect failed")
-
         ### Check if safe to modify
         if (
-            node.needs_inspection(inspection_timedelta)
+            needs_inspection
             and (inspect_reserved or not node.blazar_reserved)
             and not node.is_maintenance
             and node.provision_state in inspectable_provision_states
@@ -80,18 +84,36 @@ def start_inspection(
     dry_run: bool,
 ) -> Future:
     if dry_run:
+        # nothing changes on a dry run, the listed node is already current
         LOG.info(
             "DRY-RUN: starting inspection for node %s:%s",
             node.uuid,
             node.name,
         )
-        node = connection.baremetal.get_node(node.uuid)
     else:
         LOG.info("starting inspection for node %s:%s", node.uuid, node.name)
         node = connection.inspect_machine(node.uuid, wait=True, timeout=900)
     return node
 
 
+def log_inspection_result(future: Future, node: utils.ReservableNode) -> None:
+    if future.exception() is not None:
+        LOG.warning(
+            "node %s:%s failed to inspect with error %s",
+            node.id,
+            node.name,
+            future.exception(),
+        )
+    else:
+        inspected_node = future.result()
+        if inspected_node:
+            LOG.info(
+                "finished inspection for node %s:%s",
+                inspected_node.id,
+                inspected_node.name,
+            )
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
 
@@ -145,6 +167,7 @@ def main() -> None:
     """Drop the hammer."""
     args = parse_args()
     conn = openstack.connect(cloud=args.cloud)
+    cli.size_connection_pool(conn, args.parallel)
 
     LOG.info("Collecting node and reservation info for cloud %s", args.cloud)
 
@@ -159,8 +182,6 @@ def main() -> None:
             reinspect_failed=args.reinspect_failed,
         ),
     )
-    random.shuffle(nodes_to_inspect)
-
     num_nodes_to_inspect = min(args.limit, len(nodes_to_inspect))
     LOG.info(
         "Found %s nodes to inspect for cloud %s, processing %s",
@@ -168,35 +189,32 @@ def main() -> None:
         args.cloud,
         num_nodes_to_inspect,
     )
+    selected_nodes = random.sample(nodes_to_inspect, k=num_nodes_to_inspect)
+
+    # only hand the pool as many nodes as it can work on, so that an interrupted
+    # run leaves no queued inspections behind
+    in_flight = {}
+    with ThreadPoolExecutor(
+        max_workers=args.parallel, thread_name_prefix="inspect"
+    ) as executor:
+        for node in selected_nodes:
+            if len(in_flight) >= args.parallel:
+                done, _ = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    log_inspection_result(future, in_flight.pop(future))
 
-    future_to_inspected_node = {}
-    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
-        for node in nodes_to_inspect[:num_nodes_to_inspect]:
             inspection_future = executor.submit(
                 start_inspection,
                 connection=conn,
                 node=node,
                 dry_run=args.dry_run,
             )
-            future_to_inspected_node[inspection_future] = node
+            in_flight[inspection_future] = node
 
-        for future in concurrent.futures.as_completed(future_to_inspected_node):
-            node = future_to_inspected_node[future]
-            if future.exception() is not None:
-                LOG.warning(
-                    "node %s:%s failed to inspect with error %s",
-                    node.id,
-                    node.name,
-                    future.exception(),
-                )
-            else:
-                inspected_node = future.result()
-                if inspected_node:
-                    LOG.info(
-                        "finished inspection for node %s:%s",
-                        inspected_node.id,
-                        inspected_node.name,
-                    )
+        for future in concurrent.futures.as_completed(in_flight):
+            log_inspection_result(future, in_flight[future])
 
 
 if __name__ == "__main__":
@@ -7,14 +7,27 @@ A small CLI tool to batch-update OpenStack image metadata
 import sys
 import argparse
 import logging
-import yaml
+from concurrent.futures import ThreadPoolExecutor
 import openstack
 
+from hammers import cli
+
 
 def get_openstack_connection(cloud_name: str):
     return openstack.connect(cloud=cloud_name)
 
 
+def _parse_pair(text: str) -> tuple[str, str] | None:
+    """
+    Split 'UUID:value' into a stripped (uuid, value) tuple, or return
+    None if there is no separator.
+    """
+    uuid, sep, val = text.partition(":")
+    if not sep:
+        return None
+    return uuid.strip(), val.strip()
+
+
 def load_values_from_file(file_path: str) -> list[tuple[str, str]]:
     """
     Read a file with lines in 'UUID:value' format and return a list
@@ -26,14 +39,14 @@ def load_values_from_file(file_path: str) -> list[tuple[str, str]]:
             line = line.strip()
             if not line or line.startswith("#"):
                 continue
-            if ":" not in line:
+            pair = _parse_pair(line)
+            if pair is None:
                 logging.error(
                     f"Invalid format in line: '{line}' "
                     "(expected 'UUID:value'). Skipping."
                 )
                 continue
-            uuid, val = line.split(':', 1)
-            values.append((uuid.strip(), val.strip()))
+            values.append(pair)
     return values
 
 
@@ -54,14 +67,14 @@ def get_values(args: argparse.Namespace) -> list[tuple[str, str]]:
             " --values-file."
         )
         sys.exit(1)
-    if ":" not in args.single_value:
+    pair = _parse_pair(args.single_value)
+    if pair is None:
         logging.error(
             "Invalid format for --single-value"
             " (expected 'UUID:value')."
         )
         sys.exit(1)
-    uuid, val = args.single_value.split(':', 1)
-    return [(uuid.strip(), val.strip())]
+    return [pair]
 
 
 def tag_image(conn, uuid: str, value: str, field: str, dry_run: bool) -> None:
@@ -80,7 +93,7 @@ def tag_image(conn, uuid: str, value: str, field: str, dry_run: bool) -> None:
         logging.error(f"Error tagging image {uuid}: {e}")
 
 
-def parse_args(args: list[str]) -> argparse.Namespace:
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description=(
             "Mark images with a given metadata property (e.g., "
@@ -106,6 +119,10 @@ def parse_args(args: list[str]) -> argparse.Namespace:
         "--debug", action="store_true",
         help="Enable debug logging."
     )
+    parser.add_argument(
+        "--parallel", type=int, default=8,
+        help="Maximum number of images to tag concurrently."
+    )
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument(
         "--values-file",
@@ -119,7 +136,11 @@ def parse_args(args: list[str]) -> argparse.Namespace:
         "--single-value",
         help="Single image UUID and value in the format 'UUID:value'."
     )
-    return parser.parse_args(args)
+    return parser
+
+
+def parse_args(args: list[str]) -> argparse.Namespace:
+    return build_parser().parse_args(args)
 
 
 def main(arg_list: list[str]) -> None:
@@ -130,7 +151,7 @@ def main(arg_list: list[str]) -> None:
 
     try:
         with open(args.site_yaml, "r") as f:
-            site = yaml.safe_load(f)
+            site = cli.load_yaml(f)
     except Exception as e:
         logging.error(
             f"Failed to load site YAML '{args.site_yaml}': {e}"
@@ -143,10 +164,15 @@ def main(arg_list: list[str]) -> None:
         sys.exit(1)
 
     conn = get_openstack_connection(cloud_name)
+    cli.size_connection_pool(conn, args.parallel)
 
     values = get_values(args)
-    for uuid, val in values:
-        tag_image(conn, uuid, val, args.metadata_field, args.dry_run)
+    # tag_image logs its own failures, so the futures are not inspected
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        for uuid, val in values:
+            executor.submit(
+                tag_image, conn, uuid, val, args.metadata_field, args.dry_run
+            )
 
 
 def launch_main():
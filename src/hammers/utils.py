@@ -1,20 +1,32 @@
 """Common utilities for hammers."""
 
+import dataclasses
 import datetime
+import functools
 import json
-from collections import OrderedDict
-from collections.abc import Generator
-from urllib.parse import urlencode
+import logging
+from collections.abc import Generator, Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import ClassVar
+from urllib.parse import parse_qs, urlencode, urlparse
 from datetime import datetime as DateTime
 from datetime import timezone as TimeZone
 from datetime import timedelta as TimeDelta
 
 import iso8601
-from openstack import resource
-from openstack.baremetal.v1.node import Node as IronicNode
+from openstack import exceptions
 from openstack.connection import Connection
 from openstack.reservation.v1.host import Host as BlazarHost
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from ciso8601 import parse_datetime as _parse_datetime
+except ImportError:
+    _parse_datetime = None
+
+LOG = logging.getLogger(__name__)
 
 
 def pp(item: dict) -> None:
@@ -38,24 +50,83 @@ RESERVABLE_PROVISION_STATES = [
 # List of ironic provision states from which inspection may be initiated.
 # `available` here is a special case, we must first move the node to `manageable`
 # and move it back when inspection is complete
-INSPECTABLE_PROVISION_STATES = [
-    "available",
-    "manageable",
-]
+INSPECTABLE_PROVISION_STATES = frozenset(
+    [
+        "available",
+        "manageable",
+    ]
+)
+
+
+PORTAL_URL = "https://chameleoncloud.org"
+ALLOCATION_URL = PORTAL_URL + "/admin/allocations/api/view/{charge_code}/"
+
+# Timeout in seconds for requests to the portal API
+PORTAL_TIMEOUT = 10
+
+
+def _portal_session() -> requests.Session:
+    """Return a session which pools and retries connections to the portal."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[502, 503, 504],
+            # hand the final response back so raise_for_status() reports it
+            raise_on_status=False,
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
-class ReservableNode(IronicNode):
-    """Ironic Node object with additional fields for inspection."""
+PORTAL_SESSION = _portal_session()
 
-    uuid = resource.Body("uuid")
-    inspection_started_at = resource.Body("inspection_started_at")
-    inspection_finished_at = resource.Body("inspection_finished_at")
 
-    blazar_reserved = resource.Computed("blazar_reserved")
+@dataclasses.dataclass(slots=True)
+class ReservableNode:
+    """Ironic node fields used for inspection, annotated with reservation status.
 
-    inspection_interval = datetime.timedelta(days=30)
+    Built directly from the node listing's JSON. Creating a full openstacksdk
+    Node resource costs around a millisecond per node, which adds up over a fleet.
+    """
 
-    def needs_inspection(self, inspection_interval: datetime.timedelta = None) -> bool:
+    uuid: str
+    name: str = None
+    provision_state: str = None
+    is_maintenance: bool = False
+    properties: dict = dataclasses.field(default_factory=dict)
+    inspection_finished_at: str = None
+
+    blazar_reserved: bool = None
+
+    inspection_interval: ClassVar[datetime.timedelta] = datetime.timedelta(days=30)
+
+    @classmethod
+    def from_json(cls, node: dict) -> "ReservableNode":
+        """Build from an ironic API node representation."""
+        return cls(
+            uuid=node["uuid"],
+            name=node.get("name"),
+            provision_state=node.get("provision_state"),
+            is_maintenance=node.get("maintenance", False),
+            properties=node.get("properties") or {},
+            inspection_finished_at=node.get("inspection_finished_at"),
+        )
+
+    @property
+    def id(self) -> str:
+        return self.uuid
+
+    def needs_inspection(
+        self,
+        inspection_interval: datetime.timedelta = None,
+        now: datetime.datetime = None,
+    ) -> bool:
         """Return true if last inspected older than threshold."""
         if not inspection_interval:
             inspection_interval = self.inspection_interval
@@ -65,10 +136,9 @@ class ReservableNode(IronicNode):
             # inspected, or most recent inspection failed to complete
             return True
 
-        last_inspected_date = datetime.datetime.fromisoformat(
-            self.inspection_finished_at,
-        )
-        now = datetime.datetime.now(tz=datetime.UTC)
+        last_inspected_date = parse_isotime(self.inspection_finished_at)
+        if now is None:
+            now = datetime.datetime.now(tz=datetime.timezone.utc)
         return (now - last_inspected_date) > inspection_interval
 
     def needs_bootmode_set(self) -> bool:
@@ -85,18 +155,25 @@ def ironic_nodes_with_last_inspected(
 ) -> Generator[ReservableNode]:
     """Return list of ironic nodes."""
     bm_proxy = connection.baremetal
-    query_string = urlencode(
-        OrderedDict(
-            fields="uuid,name,provision_state,power_state,maintenance,inspect_interface,properties,inspection_finished_at",
-        ),
-    )
-    uri = "nodes/?" + query_string
+    query = {
+        "fields": "uuid,name,provision_state,maintenance,properties,inspection_finished_at",
+    }
 
-    result = bm_proxy.get(url=uri, microversion="1.82")
+    # ironic caps each response at its max_limit, follow the markers until the
+    # last page so large fleets aren't silently truncated
+    while True:
+        uri = "nodes/?" + urlencode(query)
+        result = bm_proxy.get(url=uri, microversion="1.82")
+        body = result.json()
 
-    for node in result.json().get("nodes"):
-        node_ref = ReservableNode(**node)
-        yield node_ref
+        for node in body.get("nodes"):
+            node_ref = ReservableNode.from_json(node)
+            yield node_ref
+
+        next_url = body.get("next")
+        if not next_url:
+            break
+        query["marker"] = parse_qs(urlparse(next_url).query)["marker"][0]
 
 
 def unreserved_blazar_hosts(connection: Connection) -> Generator[BlazarHost]:
@@ -104,44 +181,57 @@ def unreserved_blazar_hosts(connection: Connection) -> Generator[BlazarHost]:
     res_proxy = connection.reservation
 
     allocations = res_proxy.host_allocations()
-    now = datetime.datetime.now(tz=datetime.UTC)
+    # one listing instead of a get_host round-trip per allocation
+    hosts_by_id = {h.id: h for h in res_proxy.hosts()}
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
     for alloc in allocations:
-        in_reservation = False
         reservations = alloc.reservations
         if reservations:
-            min_start_date = None
+            in_reservation = False
+            start_dates = []
             for res in reservations:
-                start_date = iso8601.parse_date(res.start_date)
-                end_date = iso8601.parse_date(res.end_date)
-                if now >= start_date and now <= end_date:
+                start_date = parse_isotime(res.start_date)
+                # the chained comparison only parses end_date once the reservation has started
+                if start_date <= now <= parse_isotime(res.end_date):
                     in_reservation = True
                     break
-                # get start of earliest reservation
-                if not min_start_date:
-                    min_start_date = start_date
-                else:
-                    min_start_date = min(min_start_date, start_date)
+                start_dates.append(start_date)
             if in_reservation:
                 continue
             else:
+                # get start of earliest reservation
+                min_start_date = min(start_dates)
                 time_to_res = min_start_date - now
                 if time_to_res <= MINIMUM_BUFFER_SECONDS:
-                    print(
-                        f"Skipping {alloc.resource_id}: next reservation starts in {time_to_res}"
+                    LOG.info(
+                        "Skipping %s: next reservation starts in %s",
+                        alloc.resource_id,
+                        time_to_res,
                     )
 
-        yield res_proxy.get_host(alloc.resource_id)
+        host = hosts_by_id.get(alloc.resource_id)
+        if host is None:
+            LOG.warning("Allocation for unknown blazar host %s", alloc.resource_id)
+            continue
+        yield host
 
 
-def ironic_nodes_with_reservation_status(connection: Connection) -> Generator[dict]:
+def ironic_nodes_with_reservation_status(
+    connection: Connection,
+) -> Generator[ReservableNode]:
     """Yield ironic hosts annotated with `blazar_reserved=True` if reserved."""
-    # for efficiency, get selection of fields from all ironic nodes in one query
-    ironic_nodes_cache = ironic_nodes_with_last_inspected(connection)
-
-    # get all blazar hosts where the allocation has an empty reservations array
-    unreserved_node_ids = [
-        n.hypervisor_hostname for n in unreserved_blazar_hosts(connection)
-    ]
+    # ironic and blazar are independent, so query them at the same time
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # for efficiency, get selection of fields from all ironic nodes in one query
+        ironic_nodes_future = executor.submit(
+            lambda: list(ironic_nodes_with_last_inspected(connection))
+        )
+        # get all blazar hosts where the allocation has an empty reservations array
+        unreserved_node_ids_future = executor.submit(
+            lambda: {n.hypervisor_hostname for n in unreserved_blazar_hosts(connection)}
+        )
+    ironic_nodes_cache = ironic_nodes_future.result()
+    unreserved_node_ids = unreserved_node_ids_future.result()
 
     for n in ironic_nodes_cache:
         if n.uuid in unreserved_node_ids:
@@ -151,25 +241,70 @@ def ironic_nodes_with_reservation_status(connection: Connection) -> Generator[di
         yield n
 
 
-def grace_period_expired(last_alloc_str: str, grace_period: TimeDelta) -> bool:
-    """Return true if resource hasn't been updated in longer than grace period."""
-    last_updated = iso8601.parse_date(last_alloc_str)
-    now = DateTime.now(tz=TimeZone.utc)
+def _fromisoformat(timestamp: str) -> DateTime:
+    if timestamp.endswith("Z"):
+        timestamp = timestamp[:-1] + "+00:00"
+    return DateTime.fromisoformat(timestamp)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_isotime(timestamp: str) -> DateTime:
+    """Parse an ISO 8601 timestamp, assuming UTC if it has no offset.
+
+    Uses `ciso8601` when installed, otherwise the C implementation of
+    `datetime.fromisoformat`, falling back to `iso8601` for forms those can't parse.
+    Results are cached, since a reservation's dates show up once per allocated host.
+    """
+    try:
+        parsed = (_parse_datetime or _fromisoformat)(timestamp)
+    except ValueError:
+        parsed = iso8601.parse_date(timestamp)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=TimeZone.utc)
+    return parsed
+
+
+def grace_period_expired(
+    last_alloc_str: str,
+    grace_period: TimeDelta,
+    now: DateTime = None,
+) -> bool:
+    """Return true if resource hasn't been updated in longer than grace period.
+
+    Callers checking many resources can pass `now` once instead of reading the clock per call.
+    """
+    last_updated = parse_isotime(last_alloc_str)
+    if now is None:
+        now = DateTime.now(tz=TimeZone.utc)
 
     # explicitly time of last update is older than expiry time
     return last_updated < (now - grace_period)
 
 
-def project_is_expired(charge_code, grace_period, ignore_pending, api_token, log):
+@functools.lru_cache(maxsize=None)
+def _fetch_allocation(charge_code: str, api_token: str) -> dict:
+    """Fetch allocation data for a charge code from the portal.
+
+    Results are cached for the lifetime of the process, so each charge code
+    costs at most one portal request per run. Failed requests raise and are
+    not cached.
+    """
+    res = PORTAL_SESSION.get(
+        ALLOCATION_URL.format(charge_code=charge_code),
+        params={"token": api_token},
+        timeout=PORTAL_TIMEOUT,
+    )
+    res.raise_for_status()
+    return res.json()
+
+
+def project_is_expired(charge_code, grace_period, ignore_pending, api_token, log, now=None):
     """Return true if the project is expired, given grace period and pending allocation criteria"""
-    api_url = f"https://chameleoncloud.org/admin/allocations/api/view/{charge_code}/?token={api_token}"
-    res = requests.get(api_url)
     try:
-        res.raise_for_status()
-        alloc_json = res.json()
-    except (requests.HTTPError, requests.exceptions.JSONDecodeError):
-        # For these exceptions, we assume the project has not expired
-        log.debug("Error fetching allocation data for %s. Status %s", charge_code, res.status_code)
+        alloc_json = _fetch_allocation(charge_code, api_token)
+    except requests.RequestException as ex:
+        # If we can't fetch allocation data, we assume the project has not expired
+        log.debug("Error fetching allocation data for %s: %s", charge_code, ex)
         return False
     if alloc_json["is_active"]:
         log.debug("Project %s is active", charge_code)
@@ -177,8 +312,55 @@ def project_is_expired(charge_code, grace_period, ignore_pending, api_token, log
     if ignore_pending and alloc_json["has_pending_allocation"]:
         log.debug("Project %s has pending allocation", charge_code)
         return False
-    if not grace_period_expired(alloc_json["expiration_date"], grace_period):
+    if not grace_period_expired(alloc_json["expiration_date"], grace_period, now):
         log.debug("Project %s within grace period", charge_code)
         return False
     log.debug("Project %s has expired", charge_code)
     return True
+
+
+def expired_projects(
+    connection: Connection,
+    project_ids: Iterable[str],
+    grace_period: TimeDelta,
+    ignore_pending: bool,
+    api_token: str,
+    log,
+    parallel: int = 16,
+) -> set[str]:
+    """Return the ids of expired projects among `project_ids`.
+
+    `project_ids` may be a lazy iterable, such as one fed by a paginated listing.
+    Each project is looked up in a worker thread as soon as it is first seen, so
+    portal lookups overlap with fetching the rest of the listing. Projects which
+    no longer exist are logged and treated as not expired.
+    """
+
+    now = DateTime.now(tz=TimeZone.utc)
+
+    def _is_expired(project_id):
+        project = connection.identity.get_project(project_id)
+        # Some old KVM projects have `charge_code` set, but new ones use `name`
+        charge_code = project.get("charge_code") or project.name
+        return project_is_expired(
+            charge_code, grace_period, ignore_pending, api_token, log, now=now
+        )
+
+    expired = set()
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        future_to_project_id = {}
+        seen = set()
+        for project_id in project_ids:
+            if project_id in seen:
+                continue
+            seen.add(project_id)
+            future_to_project_id[executor.submit(_is_expired, project_id)] = project_id
+
+        for future in as_completed(future_to_project_id):
+            project_id = future_to_project_id[future]
+            try:
+                if future.result():
+                    expired.add(project_id)
+            except exceptions.NotFoundException:
+                log.warning("Project %s not found, skipping its resources", project_id)
+    return expired
@@ -0,0 +1,67 @@
+from unittest import mock
+
+import pytest
+import yaml
+
+from hammers import cli
+
+
+def test_base_parser_defaults():
+    result = cli.base_parser().parse_args([])
+    assert result.cloud is None
+    assert not result.dry_run
+    assert not result.debug
+
+
+def test_expired_project_args():
+    parser = cli.base_parser()
+    cli.add_expired_project_args(parser)
+    result = parser.parse_args(
+        ["--cloud", "foo", "--portal-api-token", "token", "--grace-days", "3"]
+    )
+    assert result.cloud == "foo"
+    assert result.portal_api_token == "token"
+    assert result.grace_days == 3
+    assert not result.ignore_pending
+
+
+def test_expired_project_args_require_token():
+    parser = cli.base_parser()
+    cli.add_expired_project_args(parser)
+    with pytest.raises(SystemExit):
+        parser.parse_args(["--cloud", "foo"])
+
+
+def test_load_yaml():
+    assert cli.load_yaml("image_store_cloud: uc_dev\n") == {"image_store_cloud": "uc_dev"}
+
+
+def test_load_yaml_is_safe():
+    with pytest.raises(yaml.constructor.ConstructorError):
+        cli.load_yaml("!!python/object/apply:os.system ['true']")
+
+
+@mock.patch("openstack.connect")
+def test_get_connection_is_reused(mock_connect):
+    cli.get_connection.cache_clear()
+    first = cli.get_connection("foo")
+    second = cli.get_connection("foo")
+    assert first is second
+    mock_connect.assert_called_once_with(cloud="foo")
+    cli.get_connection.cache_clear()
+
+
+@mock.patch("hammers.cli.TCPKeepAliveAdapter")
+def test_size_connection_pool(mock_adapter):
+    conn = mock.Mock()
+    session = conn.session.session
+    cli.size_connection_pool(conn, 32)
+    mock_adapter.assert_called_once_with(pool_connections=32, pool_maxsize=32)
+    assert {c.args[0] for c in session.mount.call_args_list} == {"https://", "http://"}
+    assert all(c.args[1] is mock_adapter.return_value for c in session.mount.call_args_list)
+
+
+def test_size_connection_pool_keeps_default():
+    conn = mock.Mock()
+    cli.size_connection_pool(conn, 4)
+    conn.session.session.mount.assert_not_called()
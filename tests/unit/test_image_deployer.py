@@ -1,7 +1,7 @@
 import datetime
+import io
 import json
 import pytest
-import requests
 
 
 from unittest import mock
@@ -26,6 +26,18 @@ class FakeResponse:
         return json.loads(self.text)
 
 
+class FakeStreamResponse(FakeResponse):
+    def __init__(self, data=b"", **kwargs):
+        super().__init__(**kwargs)
+        self.raw = io.BytesIO(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
 class DummyImage:
     def __init__(self, current_value, name):
         self.name = name
@@ -72,7 +84,7 @@ def test_parse_args_dry_run_debug():
 def test_get_current_value_success(monkeypatch):
     dummy = {"key": "value"}
     resp = FakeResponse(status_code=200, text=json.dumps(dummy))
-    monkeypatch.setattr(requests, "get", lambda url: resp)
+    monkeypatch.setattr(image_deployer.SESSION, "get", lambda url: resp)
 
     result = image_deployer.get_current_value(
         "http://image/store",
@@ -84,7 +96,7 @@ def test_get_current_value_success(monkeypatch):
 
 def test_get_current_value_failure(monkeypatch):
     resp = FakeResponse(status_code=404, content=b"not found")
-    monkeypatch.setattr(requests, "get", lambda url: resp)
+    monkeypatch.setattr(image_deployer.SESSION, "get", lambda url: resp)
 
     with pytest.raises(Exception) as ex:
         image_deployer.get_current_value("a", "b", "c")
@@ -109,14 +121,14 @@ def test_should_sync_image(image_name, images_to_return, current, expected_resul
     conn = DummyConn(images_to_return)
     site_images = image_deployer.get_site_images(conn)
     assert image_deployer.should_sync_image(
-        conn, image_name, site_images, current
+        site_images, image_name, current
     ) is expected_result
 
 
 def test_download_object_to_file_success(tmp_path, monkeypatch):
     chunks = [b"a", b"b", b"c"]
     fake = FakeResponse(status_code=200, chunks=chunks)
-    monkeypatch.setattr(requests, "get", lambda url, stream=True: fake)
+    monkeypatch.setattr(image_deployer.SESSION, "get", lambda url, stream=True: fake)
 
     target = tmp_path / "out.bin"
     with open(target, "wb+") as atempfile:
@@ -133,13 +145,62 @@ def test_download_object_to_file_success(tmp_path, monkeypatch):
 
 def test_download_object_to_file_failure(monkeypatch, tmp_path):
     fake = FakeResponse(status_code=403, content=b"denied")
-    monkeypatch.setattr(requests, "get", lambda url, stream=True: fake)
+    monkeypatch.setattr(image_deployer.SESSION, "get", lambda url, stream=True: fake)
     with open(tmp_path / "dummy", "wb+") as atempfile:
         with pytest.raises(Exception) as ex:
             image_deployer.download_object_to_file("a", "b", "c", atempfile)
     assert "Error downloading object" in str(ex.value)
 
 
+def test_stream_object_to_glance_success(monkeypatch):
+    fake = FakeStreamResponse(data=b"abc", status_code=200, headers={"Content-Length": "3"})
+    monkeypatch.setattr(image_deployer.SESSION, "get", lambda url, stream=True: fake)
+
+    uploaded = []
+
+    def create_image(data, **kwargs):
+        uploaded.append(data.read())
+        return mock.Mock(id="new-id")
+
+    conn = mock.Mock()
+    conn.create_image.side_effect = create_image
+
+    image_deployer.stream_object_to_glance(
+        "http://notneeded", "path", "image.qcow2", conn,
+        "testing_", "image", "qcow2", {"current": "v1"},
+    )
+
+    assert uploaded == [b"abc"]
+    conn.create_image.assert_called_once_with(
+        name="testing_image",
+        disk_format="qcow2",
+        container_format="bare",
+        visibility="private",
+        data=mock.ANY,
+        current="v1",
+    )
+    conn.delete_image.assert_not_called()
+
+
+def test_stream_object_to_glance_incomplete(monkeypatch):
+    fake = FakeStreamResponse(data=b"ab", status_code=200, headers={"Content-Length": "3"})
+    monkeypatch.setattr(image_deployer.SESSION, "get", lambda url, stream=True: fake)
+
+    def create_image(data, **kwargs):
+        data.read()
+        return mock.Mock(id="new-id")
+
+    conn = mock.Mock()
+    conn.create_image.side_effect = create_image
+
+    with pytest.raises(Exception) as ex:
+        image_deployer.stream_object_to_glance(
+            "a", "b", "c", conn, "testing_", "image", "qcow2", {},
+        )
+    assert "Download incomplete" in str(ex.value)
+    conn.delete_image.assert_called_once_with("new-id")
+
+
 def test_get_available_images_success(monkeypatch):
     storage_url = "http://image/store/url"
     base = "chameleon-supported-images"
@@ -148,13 +209,13 @@ def test_get_available_images_success(monkeypatch):
                       "CC-Ubuntu22.04-ARM": "20250422-v1-arm"}
     image_type = "qcow2"
 
-    body = "\n".join([
-        "ignored-first-line",
-        f"{scope}/versions/20250422-v1-amd/CC-Ubuntu22.04.manifest",
-        f"{scope}/versions/20250422-v1-arm/CC-Ubuntu22.04-ARM.manifest",
+    body = json.dumps([
+        {"name": f"{scope}/versions/20250422-v1-amd/"},
+        {"name": f"{scope}/versions/20250422-v1-amd/CC-Ubuntu22.04.manifest"},
+        {"name": f"{scope}/versions/20250422-v1-arm/CC-Ubuntu22.04-ARM.manifest"},
     ])
     resp = FakeResponse(status_code=200, text=body)
-    monkeypatch.setattr(requests, "get", lambda url: resp)
+    monkeypatch.setattr(image_deployer.SESSION, "get", lambda url: resp)
 
     imgs = image_deployer.get_available_images(
         storage_url,
@@ -182,9 +243,27 @@ def test_get_available_images_success(monkeypatch):
     assert img.container_path == "chameleon-supported-images/prod/versions/20250422-v1-arm"
 
 
+def test_get_available_images_lists_each_version_once(monkeypatch):
+    current_values = {"CC-Ubuntu22.04": "20250422-v1-amd",
+                      "CC-Ubuntu24.04": "20250422-v1-amd"}
+    body = json.dumps([
+        {"name": "prod/versions/20250422-v1-amd/CC-Ubuntu22.04.manifest"},
+        {"name": "prod/versions/20250422-v1-amd/CC-Ubuntu24.04.manifest"},
+    ])
+    mock_get = mock.Mock(return_value=FakeResponse(status_code=200, text=body))
+    monkeypatch.setattr(image_deployer.SESSION, "get", mock_get)
+
+    imgs = image_deployer.get_available_images(
+        "http://image/store/url", "base", "prod", current_values, "qcow2"
+    )
+
+    assert [i.name for i in imgs] == ["CC-Ubuntu22.04", "CC-Ubuntu24.04"]
+    mock_get.assert_called_once()
+
+
 def test_get_available_images_failure(monkeypatch):
     monkeypatch.setattr(
-        requests,
+        image_deployer.SESSION,
         "get",
         lambda url: FakeResponse(status_code=500, content=b"bad")
     )
@@ -203,12 +282,12 @@ def test_get_manifest_data(status, payload, raises, monkeypatch):
         text = json.dumps(payload)
         fake = FakeResponse(status_code=200)
         fake.text = text
-        monkeypatch.setattr(requests, "get", lambda url: fake)
+        monkeypatch.setattr(image_deployer.SESSION, "get", lambda url: fake)
         result = image_deployer.get_manifest_data("http://goodurl")
         assert result == payload
     elif status == 500:
         fake = FakeResponse(status_code=500, content=b"err")
-        monkeypatch.setattr(requests, "get", lambda url: fake)
+        monkeypatch.setattr(image_deployer.SESSION, "get", lambda url: fake)
         with pytest.raises(Exception) as ex:
             raised_ex = True
             image_deployer.get_manifest_data("http://badurl")
@@ -241,10 +320,9 @@ def test_get_site_images(status, payload, raises):
         images = image_deployer.get_site_images(conn)
 
         conn.image.images.assert_called_once_with(visibility="public")
-        assert isinstance(images, list)
         assert len(images) == len(payload)
-        for expected, actual in zip(payload, images):
-            assert expected.name == actual
+        for expected in payload:
+            assert images[expected.name] == [expected]
 
 
 @pytest.mark.parametrize("properties, expected_type, raises", [
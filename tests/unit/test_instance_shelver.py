@@ -0,0 +1,149 @@
+from unittest import mock
+
+import pytest
+from openstack.compute.v2.flavor import Flavor
+from openstack.compute.v2.server import Server
+from openstack.connection import Connection
+from openstack.image.v2.image import Image
+
+from hammers import instance_shelver
+
+ADMIN_PROJECT_ID = "570aad8999f7499db99eae22fe9b29bb"
+
+
+@pytest.fixture
+def conn():
+    return mock.MagicMock(spec=Connection)
+
+
+def test_get_instances_to_retire(conn):
+    # m1.deleted is no longer listed by nova, its instances must still retire
+    conn.compute.flavors.return_value = [
+        Flavor(id="flavor-small", name="m1.small"),
+    ]
+    conn.compute.servers.return_value = [
+        Server(id="server-1", project_id="project-1", compute_host="host-1",
+               flavor={"original_name": "m1.small"}),
+        Server(id="server-2", project_id=ADMIN_PROJECT_ID, compute_host="host-2",
+               flavor={"original_name": "m1.small"}),
+        Server(id="server-3", project_id="project-2", compute_host="host-3",
+               flavor={"original_name": "m1.deleted"}),
+        Server(id="server-4", project_id="project-2", compute_host=None,
+               flavor={"original_name": "m1.small"}),
+        Server(id="server-5", project_id="project-3", compute_host="host-5",
+               flavor={"original_name": "baremetal"}),
+    ]
+
+    instances = list(instance_shelver.get_instances_to_retire(conn))
+
+    conn.compute.servers.assert_called_once_with(
+        all_projects=True,
+        limit=instance_shelver.SERVER_PAGE_SIZE,
+    )
+    assert [i.id for i in instances] == ["server-1", "server-3"]
+
+
+def fake_image_listing(statuses):
+    """Answer image `id=in:...` queries from a {snapshot_id: status} dict."""
+    def images(id):
+        ids = id.removeprefix("in:").split(",")
+        return [Image(id=i, status=statuses[i]) for i in ids if i in statuses]
+    return images
+
+
+def make_instance(instance_id, status="SHUTOFF"):
+    return Server(
+        id=instance_id,
+        name=f"{instance_id}-name",
+        project_id="project-1",
+        status=status,
+    )
+
+
+def test_retire_instance_defers_shelving_until_snapshot_active(conn):
+    instance = make_instance("server-1")
+    snapshot = Image(id="snap-1", status="queued")
+    conn.image.images.return_value = []
+    conn.create_image_snapshot.return_value = snapshot
+
+    result = instance_shelver.retire_instance(conn, instance, True, "admin")
+
+    assert result == (instance, snapshot)
+    assert conn.create_image_snapshot.call_args.kwargs["wait"] is False
+    conn.compute.shelve_server.assert_not_called()
+
+
+def test_retire_instance_shelves_when_snapshot_active(conn):
+    instance = make_instance("server-1")
+    conn.image.images.return_value = [
+        Image(id="snap-1", status="active", owner="project-1"),
+    ]
+
+    result = instance_shelver.retire_instance(conn, instance, True, "admin")
+
+    assert result == (instance, None)
+    conn.create_image_snapshot.assert_not_called()
+    conn.compute.shelve_server.assert_called_once_with(instance)
+
+
+def test_wait_for_snapshots(conn, caplog):
+    instances = {
+        "snap-active": make_instance("server-active"),
+        "snap-killed": make_instance("server-killed"),
+        "snap-deleted": make_instance("server-deleted"),
+        "snap-saving": make_instance("server-saving"),
+    }
+    # snap-deleted is missing, glance does not list deleted images
+    conn.image.images.side_effect = fake_image_listing({
+        "snap-active": "active",
+        "snap-killed": "killed",
+        "snap-saving": "saving",
+    })
+
+    instance_shelver.wait_for_snapshots(
+        conn, instances, True, timeout=0, interval=0
+    )
+
+    conn.compute.shelve_server.assert_called_once_with(instances["snap-active"])
+    messages = [r.getMessage() for r in caplog.records]
+    assert "Snapshot snap-killed of instance server-killed-name server-killed is killed, not shelving" in messages
+    assert "Snapshot snap-deleted of instance server-deleted-name server-deleted is missing, not shelving" in messages
+    assert "Timed out waiting for snapshot snap-saving of instance server-saving-name server-saving" in messages
+
+
+def test_wait_for_snapshots_polls_until_active(conn):
+    instance = make_instance("server-1")
+    statuses = {"snap-1": "saving"}
+    listing = fake_image_listing(statuses)
+
+    def images(id):
+        result = listing(id)
+        statuses["snap-1"] = "active"
+        return result
+
+    conn.image.images.side_effect = images
+
+    instance_shelver.wait_for_snapshots(
+        conn, {"snap-1": instance}, True, timeout=60, interval=0
+    )
+
+    assert conn.image.images.call_count == 2
+    conn.compute.shelve_server.assert_called_once_with(instance)
+
+
+def test_wait_for_snapshots_queries_in_batches(conn):
+    instances = {f"snap-{i}": make_instance(f"server-{i}") for i in range(5)}
+    conn.image.images.side_effect = fake_image_listing(
+        {snapshot_id: "active" for snapshot_id in instances}
+    )
+
+    instance_shelver.wait_for_snapshots(
+        conn, instances, True, timeout=0, interval=0, batch_size=2
+    )
+
+    assert [c.kwargs["id"] for c in conn.image.images.call_args_list] == [
+        "in:snap-0,snap-1",
+        "in:snap-2,snap-3",
+        "in:snap-4",
+    ]
+    assert conn.compute.shelve_server.call_count == 5
@@ -3,6 +3,7 @@ from unittest import mock
 
 import pytest
 from freezegun import freeze_time
+from openstack.connection import Connection
 from openstack.network.v2.floating_ip import FloatingIP
 from openstack.network.v2.port import Port
 from openstack.network.v2.router import Router
@@ -20,6 +21,7 @@ def test_parse_args_default():
     result = network_ip_cleaner.parse_args(args)
     assert result.cloud == "foo"
     assert result.grace_days == 7
+    assert result.parallel == 8
     assert not result.dry_run
 
 
@@ -35,6 +37,28 @@ def test_parse_args_grace_days():
     assert result.grace_days == 27
 
 
+def test_delete_floating_ips(caplog):
+    def delete_floating_ip(fip_id):
+        if fip_id == "fip-2":
+            raise Exception("conflict")
+
+    conn = mock.MagicMock()
+    conn.delete_floating_ip.side_effect = delete_floating_ip
+    fips = [
+        FloatingIP(id="fip-1", floating_ip_address="1.2.3.4"),
+        FloatingIP(id="fip-2", floating_ip_address="1.2.3.5"),
+        FloatingIP(id="fip-3", floating_ip_address="1.2.3.6"),
+    ]
+
+    network_ip_cleaner.delete_floating_ips(conn, fips, parallel=2)
+
+    assert sorted(c.args[0] for c in conn.delete_floating_ip.call_args_list) == [
+        "fip-1", "fip-2", "fip-3",
+    ]
+    errors = [r.getMessage() for r in caplog.records if r.levelname == "ERROR"]
+    assert errors == ["Error deleting floating IP fip-2:1.2.3.5: conflict"]
+
+
 @freeze_time(TIME_NOW)
 def test_grace_period_expired():
     TIME_RECENT = "2024-10-28T12:13:14Z"
@@ -47,10 +71,12 @@ def test_grace_period_expired():
     assert network_ip_cleaner.grace_period_expired(TIME_OLD, GRACE_PERIOD_LONG)
 
 
-class TestFindFLoatingIPs:
-    conn = mock.patch("openstack.connection.Connection")
-    conn.list_floating_ips = mock.MagicMock()
+@pytest.fixture
+def conn():
+    return mock.MagicMock(spec=Connection)
+
 
+class TestFindFLoatingIPs:
     @mock.patch.object(network_ip_cleaner, "grace_period_expired")
     @pytest.mark.parametrize(
         "fip_addr,fixed_addr,status,is_grace_exp,tag,should_delete",
@@ -74,6 +100,7 @@ class TestFindFLoatingIPs:
         is_grace_exp,
         tag,
         should_delete,
+        conn,
     ):
         mock_grace_period_expired.return_value = is_grace_exp
 
@@ -83,9 +110,10 @@ class TestFindFLoatingIPs:
             status=status,
             tags=[tag],
         )
-        self.conn.list_floating_ips.return_value = [FIP]
+        conn.network.ips.return_value = [FIP]
 
-        result = list(network_ip_cleaner.find_idle_floating_ips(self.conn, FAKE_GRACE_PERIOD))
+        result = list(network_ip_cleaner.find_idle_floating_ips(conn, FAKE_GRACE_PERIOD))
+        conn.network.ips.assert_called_with(status="DOWN", not_tags="blazar")
 
         if should_delete:
             assert result == [FIP]
@@ -94,10 +122,6 @@ class TestFindFLoatingIPs:
 
 
 class TestCleanRouters:
-    conn = mock.patch("openstack.connection.Connection")
-    conn.list_routers = mock.MagicMock()
-    conn.list_router_interfaces = mock.MagicMock()
-
     @mock.patch.object(network_ip_cleaner, "grace_period_expired")
     @pytest.mark.parametrize(
         "is_grace_exp,should_delete",
@@ -111,14 +135,15 @@ class TestCleanRouters:
         mock_grace_period_expired: mock.MagicMock,
         is_grace_exp,
         should_delete,
+        conn,
     ):
         mock_grace_period_expired.return_value = is_grace_exp
 
         FAKE_ROUTER = Router(name="fake_name")
-        self.conn.list_routers.return_value = [FAKE_ROUTER]
-        self.conn.list_router_interfaces.return_value = []
+        conn.list_routers.return_value = [FAKE_ROUTER]
+        conn.network.ports.return_value = []
         routers_to_delete = list(
-            network_ip_cleaner.find_idle_routers(self.conn, grace_period=FAKE_GRACE_PERIOD)
+            network_ip_cleaner.find_idle_routers(conn, grace_period=FAKE_GRACE_PERIOD)
         )
 
         if should_delete:
@@ -127,29 +152,32 @@ class TestCleanRouters:
             assert routers_to_delete == []
 
     @mock.patch.object(network_ip_cleaner, "grace_period_expired")
-    def test_with_interfaces(self, mock_grace_period_expired: mock.MagicMock):
+    def test_with_interfaces(self, mock_grace_period_expired: mock.MagicMock, conn):
         mock_grace_period_expired.return_value = True
 
         FAKE_ROUTER = Router(name="fake_name", id="fake_id")
-        self.conn.list_routers.return_value = [FAKE_ROUTER]
+        conn.list_routers.return_value = [FAKE_ROUTER]
 
         FAKE_INTERFACE = Port(
             device_id=FAKE_ROUTER.id,
             device_owner="network:router_interface",
         )
-        self.conn.list_router_interfaces.return_value = [FAKE_INTERFACE]
+        conn.network.ports.return_value = [FAKE_INTERFACE]
 
         routers_to_delete = list(
-            network_ip_cleaner.find_idle_routers(self.conn, grace_period=FAKE_GRACE_PERIOD)
+            network_ip_cleaner.find_idle_routers(conn, grace_period=FAKE_GRACE_PERIOD)
         )
 
         assert routers_to_delete == []
+        conn.network.ports.assert_called_with(
+            device_owner=network_ip_cleaner.ROUTER_INTERFACE_OWNERS
+        )
 
     @mock.patch.object(network_ip_cleaner, "grace_period_expired")
-    def test_has_blazar_ip(self, mock_grace_period_expired: mock.MagicMock):
+    def test_has_blazar_ip(self, mock_grace_period_expired: mock.MagicMock, conn):
         mock_grace_period_expired.return_value = True
 
-        self.conn.list_router_interfaces.return_value = []
+        conn.network.ports.return_value = []
 
         FAKE_ROUTER = Router(
             name="fake_name",
@@ -163,10 +191,10 @@ class TestCleanRouters:
                 ],
             },
         )
-        self.conn.list_routers.return_value = [FAKE_ROUTER]
+        conn.list_routers.return_value = [FAKE_ROUTER]
         routers_to_delete = list(
             network_ip_cleaner.find_idle_routers(
-                self.conn,
+                conn,
                 grace_period=FAKE_GRACE_PERIOD,
                 ip_whitelist={"fake-not-reservable-ip-address"},
             )
@@ -175,7 +203,7 @@ class TestCleanRouters:
 
         routers_to_delete = list(
             network_ip_cleaner.find_idle_routers(
-                self.conn,
+                conn,
                 grace_period=FAKE_GRACE_PERIOD,
                 ip_whitelist={"fake-reservable-ip-address"},
             )
@@ -1,188 +1,219 @@
-import builtins
 import logging
-import yaml
 import pytest
+from types import SimpleNamespace
 from unittest import mock
 
 
 from hammers import set_image_property
 
 
-class DummyCompute:
-    def __init__(self):
-        self.set_image_metadata = mock.MagicMock()
+_BASE = ("--site-yaml", "site.yaml",
+         "--metadata-field", "chameleon-supported")
 
 
-class DummyConn:
-    def __init__(self):
-        self.compute = DummyCompute()
+def _raise(exc):
+    raise exc
 
 
-def test_parse_args_minimal_required():
-    args = ["--site-yaml", "site.yaml",
-            "--metadata-field", "chameleon-supported",
-            "--single-value", "uuid1:yes"]
-    parsed = set_image_property.parse_args(args)
-    assert parsed.site_yaml == "site.yaml"
-    assert parsed.metadata_field == "chameleon-supported"
-    assert parsed.single_value == "uuid1:yes"
-    assert parsed.values_file is None
-    assert parsed.dry_run is False
-    assert parsed.debug is False
+@pytest.fixture(autouse=True)
+def _info_logs(caplog):
+    # set_image_property logs through the root logger and never at DEBUG
+    caplog.set_level(logging.INFO)
 
 
-def test_parse_args_values_file_and_flags():
-    args = ["--site-yaml", "site.yaml",
-            "--metadata-field", "chameleon-supported",
-            "--values-file", "vals.txt",
-            "--dry-run", "--debug"]
-    parsed = set_image_property.parse_args(args)
-    assert parsed.values_file == "vals.txt"
-    assert parsed.single_value is None
-    assert parsed.dry_run is True
-    assert parsed.debug is True
+@pytest.fixture(scope="module")
+def parser():
+    return set_image_property.build_parser()
+
+
+@pytest.mark.parametrize("argv, expected", [
+    ([*_BASE, "--single-value", "uuid1:yes"], {
+        "site_yaml": "site.yaml",
+        "metadata_field": "chameleon-supported",
+        "single_value": "uuid1:yes",
+        "values_file": None,
+        "dry_run": False,
+        "debug": False,
+        "parallel": 8,
+    }),
+    ([*_BASE, "--values-file", "vals.txt", "--dry-run", "--debug"], {
+        "values_file": "vals.txt",
+        "single_value": None,
+        "dry_run": True,
+        "debug": True,
+    }),
+])
+def test_parse_args(parser, argv, expected):
+    parsed = vars(parser.parse_args(argv))
+    assert {k: parsed[k] for k in expected} == expected
 
 
 def test_parse_args_mutually_exclusive_args_error():
     with pytest.raises(SystemExit):
         # missing both --single-value and --values-file
-        set_image_property.parse_args([
-            "--site-yaml", "site.yaml",
-            "--metadata-field", "chameleon-supported"
-        ])
+        set_image_property.parse_args(list(_BASE))
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("uuid1:val1", ("uuid1", "val1")),
+    (" uuid1 : val:with:colons ", ("uuid1", "val:with:colons")),
+    ("uuid1:", ("uuid1", "")),
+    ("badline", None),
+])
+def test_parse_pair(text, expected):
+    assert set_image_property._parse_pair(text) == expected
 
 
-def test_load_values_from_file(tmp_path):
-    contents = "\n".join([
+@pytest.fixture(scope="session")
+def values_file(tmp_path_factory):
+    f = tmp_path_factory.mktemp("vals") / "values.txt"
+    f.write_text("\n".join([
         "# a comment",
         "",
         "uuid1:val1",
         "badline",
-    ])
-    f = tmp_path / "values.txt"
-    f.write_text(contents)
+    ]))
+    return str(f)
+
+
+@pytest.fixture(scope="session")
+def empty_site_yaml(tmp_path_factory):
+    site = tmp_path_factory.mktemp("site") / "site.yaml"
+    site.write_text("{}\n")
+    return str(site)
+
 
-    vals = set_image_property.load_values_from_file(str(f))
+def test_load_values_from_file(values_file):
+    vals = set_image_property.load_values_from_file(values_file)
     assert vals == [
         ("uuid1", "val1"),
     ]
 
 
-def test_get_values_from_file(tmp_path):
-    f = tmp_path / "vals.txt"
-    f.write_text("uuid123:deprecated")
-    args = mock.Mock(values_file=str(f), single_value=None)
+def test_get_values_from_file(values_file):
+    args = SimpleNamespace(values_file=values_file, single_value=None)
     result = set_image_property.get_values(args)
-    assert result == [("uuid123", "deprecated")]
+    assert result == [("uuid1", "val1")]
 
 
 def test_get_values_file_not_found(monkeypatch, caplog):
-    args = mock.Mock(values_file="does_not_exist.txt", single_value=None)
+    args = SimpleNamespace(values_file="does_not_exist.txt", single_value=None)
     monkeypatch.setattr(set_image_property, "load_values_from_file",
-                        lambda path: (_ for _ in ()).throw(FileNotFoundError))
+                        lambda path: _raise(FileNotFoundError()))
     with pytest.raises(SystemExit) as ex:
         set_image_property.get_values(args)
     assert ex.value.code == 1
-    assert "File not found: does_not_exist.txt" in caplog.text
+    assert "File not found: does_not_exist.txt" in caplog.records[-1].getMessage()
 
 
 def test_get_values_single_missing(caplog):
-    args = mock.Mock(values_file=None, single_value=None)
+    args = SimpleNamespace(values_file=None, single_value=None)
     with pytest.raises(SystemExit) as ex:
         set_image_property.get_values(args)
     assert ex.value.code == 1
-    assert "--single-value is required" in caplog.text
+    assert "--single-value is required" in caplog.records[-1].getMessage()
 
 
 def test_get_values_single_invalid_format(caplog):
-    args = mock.Mock(values_file=None, single_value="badformat")
+    args = SimpleNamespace(values_file=None, single_value="badformat")
     with pytest.raises(SystemExit) as ex:
         set_image_property.get_values(args)
     assert ex.value.code == 1
-    assert "Invalid format for --single-value" in caplog.text
+    assert "Invalid format for --single-value" in caplog.records[-1].getMessage()
 
 
 def test_get_values_single_valid():
-    args = mock.Mock(values_file=None, single_value="uuid1:no")
+    args = SimpleNamespace(values_file=None, single_value="uuid1:no")
     result = set_image_property.get_values(args)
     assert result == [("uuid1", "no")]
 
 
-def test_tag_image_dry_run(caplog):
-    conn = DummyConn()
-    caplog.set_level(logging.DEBUG)
+@pytest.mark.parametrize("uuid, value, dry_run, side_effect, expected", [
+    ("uuid1", "no", True, None,
+     "DRY-RUN: would set 'chameleon-supported=no' on image uuid1"),
+    ("uuid2", "yes", False, None,
+     "chameleon-supported=yes successfully set on image uuid2"),
+    ("uuid3", "no", False, Exception("failure"),
+     "Error tagging image uuid3: failure"),
+])
+def test_tag_image(caplog, uuid, value, dry_run, side_effect, expected):
+    conn = mock.MagicMock()
+    conn.compute.set_image_metadata.side_effect = side_effect
     set_image_property.tag_image(
         conn,
-        "uuid1",
-        "no",
+        uuid,
+        value,
         "chameleon-supported",
-        dry_run=True
-    )
-    assert "DRY-RUN: would set 'chameleon-supported=no' on image uuid1" in caplog.text
-    assert conn.compute.set_image_metadata.call_count == 0
-
-
-def test_tag_image_success(caplog):
-    conn = DummyConn()
-    caplog.set_level(logging.DEBUG)
-    set_image_property.tag_image(
-        conn,
-        "uuid2",
-        "yes",
-        "chameleon-supported",
-        dry_run=False
-    )
-    conn.compute.set_image_metadata.assert_called_once_with(
-        "uuid2",
-        **{"chameleon-supported": "yes"}
+        dry_run=dry_run
     )
-    assert "chameleon-supported=yes successfully set on image uuid2" in caplog.text
-
-
-def test_tag_image_failure(caplog):
-    conn = DummyConn()
-    conn.compute.set_image_metadata.side_effect = Exception("failure")
-    set_image_property.tag_image(
-        conn,
-        "uuid3",
-        "no",
-        "chameleon-supported",
-        dry_run=False
-    )
-    assert "Error tagging image uuid3: failure" in caplog.text
+    if dry_run:
+        conn.compute.set_image_metadata.assert_not_called()
+    else:
+        conn.compute.set_image_metadata.assert_called_once_with(
+            uuid,
+            **{"chameleon-supported": value}
+        )
+    assert expected in caplog.records[-1].getMessage()
 
 
 def test_main_site_yaml_load_failure(monkeypatch, caplog):
-    args = mock.Mock(
+    args = SimpleNamespace(
         site_yaml="noexist.yaml",
         debug=False,
         dry_run=False,
         metadata_field="chameleon-supported",
         values_file=None,
-        single_value=None
+        single_value=None,
+        parallel=8,
     )
     monkeypatch.setattr(set_image_property, "parse_args", lambda _: args)
-    monkeypatch.setattr(builtins, "open",
-                        lambda *a, **k: (_ for _ in ()).throw(Exception("failed")))
+    # shadow open in the module's globals only, not for the whole process
+    monkeypatch.setattr(set_image_property, "open",
+                        lambda *a, **k: _raise(Exception("failed")),
+                        raising=False)
     with pytest.raises(SystemExit) as ex:
         set_image_property.main([])
     assert ex.value.code == 1
-    assert "Failed to load site YAML 'noexist.yaml': failed" in caplog.text
+    assert (
+        "Failed to load site YAML 'noexist.yaml': failed"
+        in caplog.records[-1].getMessage()
+    )
 
 
-def test_main_missing_cloud(monkeypatch, tmp_path, caplog):
-    site = tmp_path / "site.yaml"
-    site.write_text(yaml.safe_dump({}))
-    args = mock.Mock(
-        site_yaml=str(site),
+def test_main_missing_cloud(monkeypatch, empty_site_yaml, caplog):
+    args = SimpleNamespace(
+        site_yaml=empty_site_yaml,
         debug=False,
         dry_run=False,
         metadata_field="chameleon-supported",
         values_file=None,
-        single_value=None
+        single_value=None,
+        parallel=8,
     )
     monkeypatch.setattr(set_image_property, "parse_args", lambda _: args)
     with pytest.raises(SystemExit) as ex:
         set_image_property.main([])
     assert ex.value.code == 1
-    assert "Required 'image_store_cloud' key not found in site YAML" in caplog.text
+    assert (
+        "Required 'image_store_cloud' key not found in site YAML"
+        in caplog.records[-1].getMessage()
+    )
+
+
+def test_main_tags_every_image(monkeypatch, tmp_path):
+    site = tmp_path / "site.yaml"
+    site.write_text("image_store_cloud: cloud\n")
+    values = tmp_path / "vals.txt"
+    values.write_text("uuid1:yes\nuuid2:no\nuuid3:yes\n")
+    conn = mock.MagicMock()
+    monkeypatch.setattr(set_image_property, "get_openstack_connection", lambda _: conn)
+    set_image_property.main([
+        "--site-yaml", str(site),
+        "--metadata-field", "chameleon-supported",
+        "--values-file", str(values),
+        "--parallel", "2",
+    ])
+    calls = conn.compute.set_image_metadata.call_args_list
+    assert sorted((c.args[0], c.kwargs["chameleon-supported"]) for c in calls) == [
+        ("uuid1", "yes"), ("uuid2", "no"), ("uuid3", "yes"),
+    ]
@@ -0,0 +1,131 @@
+from datetime import datetime as DateTime
+from datetime import timezone as TimeZone
+from datetime import timedelta as TimeDelta
+from unittest import mock
+
+import pytest
+import requests
+from freezegun import freeze_time
+
+from hammers import utils
+
+
+@pytest.mark.parametrize(
+    "timestamp, expected",
+    [
+        ("2024-10-30T12:13:14Z", DateTime(2024, 10, 30, 12, 13, 14, tzinfo=TimeZone.utc)),
+        ("2024-10-30T12:13:14+00:00", DateTime(2024, 10, 30, 12, 13, 14, tzinfo=TimeZone.utc)),
+        ("2024-10-30 12:13:14", DateTime(2024, 10, 30, 12, 13, 14, tzinfo=TimeZone.utc)),
+        ("2024-10-30", DateTime(2024, 10, 30, tzinfo=TimeZone.utc)),
+        (
+            "2024-10-30T07:13:14.5-05:00",
+            DateTime(2024, 10, 30, 12, 13, 14, 500000, tzinfo=TimeZone.utc),
+        ),
+    ],
+)
+def test_parse_isotime(timestamp, expected):
+    assert utils.parse_isotime(timestamp) == expected
+
+
+def test_parse_isotime_invalid():
+    with pytest.raises(ValueError):
+        utils.parse_isotime("not a timestamp")
+
+
+def test_grace_period_expired_with_now():
+    now = DateTime(2024, 10, 30, 12, 13, 14, tzinfo=TimeZone.utc)
+    assert utils.grace_period_expired("2024-10-28T12:13:14Z", TimeDelta(days=1), now)
+    assert not utils.grace_period_expired("2024-10-28T12:13:14Z", TimeDelta(days=7), now)
+
+
+def test_ironic_nodes_with_last_inspected_follows_next():
+    conn = mock.Mock()
+    conn.baremetal.get.return_value.json.side_effect = [
+        {
+            "nodes": [{"uuid": "node-1"}],
+            "next": "https://ironic/v1/nodes?limit=1&marker=node-1",
+        },
+        {"nodes": [{"uuid": "node-2"}]},
+    ]
+
+    nodes = list(utils.ironic_nodes_with_last_inspected(conn))
+
+    assert [n.uuid for n in nodes] == ["node-1", "node-2"]
+    second_uri = conn.baremetal.get.call_args_list[1].kwargs["url"]
+    assert "marker=node-1" in second_uri
+    assert "fields=" in second_uri
+
+
+def test_reservable_node_from_json():
+    node = utils.ReservableNode.from_json(
+        {
+            "uuid": "node-1",
+            "name": "c01",
+            "provision_state": "available",
+            "maintenance": True,
+            "properties": {"capabilities": "boot_mode:uefi"},
+            "inspection_finished_at": None,
+        }
+    )
+    assert node.id == "node-1"
+    assert node.is_maintenance
+    assert node.needs_inspection()
+    assert not node.needs_bootmode_set()
+
+
+@freeze_time("2024-10-30T12:00:00Z")
+def test_unreserved_blazar_hosts(caplog):
+    conn = mock.Mock()
+    conn.reservation.hosts.return_value = [
+        mock.Mock(id="busy"), mock.Mock(id="free"), mock.Mock(id="later"),
+    ]
+    conn.reservation.host_allocations.return_value = [
+        mock.Mock(resource_id="busy", reservations=[
+            mock.Mock(start_date="2024-10-29T00:00:00Z", end_date="2024-10-31T00:00:00Z"),
+        ]),
+        mock.Mock(resource_id="free", reservations=[]),
+        mock.Mock(resource_id="later", reservations=[
+            mock.Mock(start_date="2024-11-02T00:00:00Z", end_date="2024-11-03T00:00:00Z"),
+            mock.Mock(start_date="2024-11-01T00:00:00Z", end_date="2024-11-02T00:00:00Z"),
+        ]),
+        mock.Mock(resource_id="deleted", reservations=[]),
+    ]
+
+    hosts = list(utils.unreserved_blazar_hosts(conn))
+
+    assert [h.id for h in hosts] == ["free", "later"]
+    assert "Allocation for unknown blazar host deleted" in caplog.messages
+
+
+@mock.patch.object(utils, "unreserved_blazar_hosts")
+@mock.patch.object(utils, "ironic_nodes_with_last_inspected")
+def test_ironic_nodes_with_reservation_status(mock_nodes, mock_unreserved):
+    mock_nodes.return_value = iter(
+        [utils.ReservableNode(uuid="node-1"), utils.ReservableNode(uuid="node-2")]
+    )
+    mock_unreserved.return_value = iter([mock.Mock(hypervisor_hostname="node-2")])
+
+    nodes = list(utils.ironic_nodes_with_reservation_status(mock.Mock()))
+
+    assert [(n.uuid, n.blazar_reserved) for n in nodes] == [
+        ("node-1", True),
+        ("node-2", False),
+    ]
+
+
+@mock.patch.object(utils, "_fetch_allocation")
+def test_project_is_expired_retries_after_request_error(mock_fetch):
+    mock_fetch.side_effect = [
+        requests.ConnectionError("portal down"),
+        {
+            "is_active": False,
+            "has_pending_allocation": False,
+            "expiration_date": "2024-01-01T00:00:00Z",
+        },
+    ]
+    args = ("CH-1", TimeDelta(days=7), False, "token", mock.Mock())
+    now = DateTime(2024, 10, 30, tzinfo=TimeZone.utc)
+
+    assert not utils.project_is_expired(*args, now=now)
+    assert utils.project_is_expired(*args, now=now)
+    assert mock_fetch.call_count == 2